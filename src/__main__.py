@@ -12,11 +12,14 @@
 
 ## Application-side Log Table
 
+Logs are JSON lines (`config["logging"]`) with the error as `code` field.
+
 | Error                 | Description                                                            |
 |-----------------------|------------------------------------------------------------------------|
 | INPUT                 | Please enter valid ip address, port number, and an application section |
 | INPUT                 | You must enter building number between 1 to n                          |
 | INPUT                 | Unknown section                                                        |
+| INPUT                 | Collector mode only supports sensors section                           |
 | CODE                  | `sections.socket_connection`: Error in callback function.              |
 | SOCKET                | Access is closed.                                                      |
 | SOCKET                | DNS is not exists.                                                     |
@@ -37,6 +40,20 @@
 | MONGODB               | Config error                                                           |
 | MONGODB               | Invalid operation to find entered floor number.                        |
 | SENSORS               | Floor not found for this building name and IP address.                 |
+| SUPERVISOR            | {connection} reconnected after {seconds} ({attempts}, {downtime})      |
+| SUPERVISOR            | {connection} circuit is open after {failures}, retry every {seconds}   |
+| SPOOL                 | Disk usage cap reached, oldest segment dropped. / Corrupted record.    |
+| COLLECTOR             | Collecting {n} gateways. / Gateway {ip} has no valid port, skipped.    |
+| SHARDS                | Shard {i} is assigned {n} gateways. / exited / is not responding.      |
+| PAYLOAD               | Published message body, when `config["logging"]["payloads"]` is on     |
+| METRICS               | Serving on `http://{host}:{port}/metrics`, or endpoint not available   |
+| SERVICE               | Service is ready in {ms}.                                              |
+| REDIS                 | Live state write failed. {dynamic error}                               |
+| PROFILER              | Sampling started (`SIGUSR2`), or samples written to `profile.folded`   |
+| BARRIER               | Invalid barrier command. / Unknown barrier command: {command}          |
+| BARRIER               | {n} barrier commands dropped, they're redelivered.                     |
+| RFID                  | Tag {tag} is not published. {dynamic error}                            |
+| HISTORY               | Snapshot is not compatible / not readable / not saved.                 |
 
 ## Server-side Logs
 
@@ -45,80 +62,60 @@
 | 1101 | info              | RabbitMQ successful connection                      |
 | 1201 | info              | Redis successful connection                         |
 | 1301 | info              | Section is working                                  |
+| 1302 | info              | RFID tag read                                       |
+| 1303 | info              | Barrier command executed                            |
 | 2300 | warning           | Sensor disconnection                                |
+| 2301 | warning           | Unregistered RFID tag read                          |
+| 2302 | warning           | Barrier command rejected or expired                 |
 | 4300 | critical          | Global client socket timeout                        |
 | 4000 | critical          | Redis connection error                              |
 | 4000 | critical          | Redis connection error                              |
 | 4301 | critical          | Floor not found with this building and IP address   |
+| 4302 | critical          | Barrier controller didn't acknowledge the command   |
 """
 
-import argparse, sys
+import argparse, os, sys
 
-from config import config
-from sections import AppSections
+from config import config, load_config
 
 
 if __name__ == "__main__":
-    app_section: AppSections
+    parser = argparse.ArgumentParser(
+        prog="MCI Smart Parking Gateway Service Script",
+        description="With this service you can find every slots sensors, barriers, and RFID server only with IP address and port number",
+        epilog=f"""
+        Don't forget use these buildings name for your input:
+        {config["buildings"]}
+        """,
+    )
+    for key, value in config["options"].items():
+        parser.add_argument(value, key)
+    args = parser.parse_args()
+
+    if args.config:
+        # Before any other module reads its defaults from `config`, and
+        # inherited by the shard worker processes.
+        os.environ["MCI_CONFIG"] = args.config
+        load_config(args.config)
+    for key, value in vars(args).items():
+        if key in config["service"] and value is not None:
+            config["service"][key] = value
+
+    # Interactive run of an operator
+    if config["service"]["building"] is None and sys.stdin.isatty():
+        print("Enter building name from the following list:")
+
+        for index, building_name in enumerate(config["buildings"]):
+            print(f"{index + 1}) {building_name}")
+
+        config["service"]["building"] = input("Building name: ")
+
+    import service
+
     try:
-        parser = argparse.ArgumentParser(
-            prog="MCI Smart Parking Gateway Service Script",
-            description="With this service you can find every slots sensors, barriers, and RFID server only with IP address and port number",
-            epilog=f"""
-            Don't forget use these buildings name for your input:
-            {config["buildings"]}
-            """,
-        )
-        for key, value in config["options"].items():
-            parser.add_argument(value, key)
-        args = parser.parse_args()
-
-        if args.ip == None or args.port == None or args.section == None:
-            print(
-                "[INPUT]: Please enter valid ip address, port number, and an application section"
-            )
-        else:
-            print("Enter building name from the following list:")
-
-            for index, building_name in enumerate(config["buildings"]):
-                print(f"{index + 1}) {building_name}")
-
-            building: int = int(input("Building name: "))
-
-            if building < 0 or building > len(config["buildings"]):
-                print(
-                    f"[INPUT]: You must enter building number between 1 to {len(config["buildings"])}"
-                )
-            else:
-                # Initialized application with proper section, port, and ip
-                # address.
-                app_section = AppSections(
-                    args.ip,
-                    int(args.port),
-                    config["buildings"][building - 1],
-                    queue_name="logs",
-                )
-
-                match args.section:
-                    case "sensors":
-                        app_section.queue_route = "logs.utlrasonic-sensors"
-                        app_section.queue_namespace_provider = (
-                            "App\\Jobs\\SystemLogs\\UltrasonicSensors\\SensorLog"
-                        )
-
-                        app_section.socket_connection(app_section.get_sensors_data)
-                    case "barrier":
-                        # TODO:
-                        print("Performing barrier application section.")
-                    case "rfid":
-                        app_section.queue_route = "logs.rfids"
-                        app_section.queue_namespace_provider = (
-                            "App\\Jobs\\SystemLogs\\RFIDs\\RFIDLog"
-                        )
-                        print("Performing rfid application section.")
-                    case _:
-                        print("[INPUT]: Unknown section")
+        service.run()
+    except service.InputError as e:
+        print(f"[INPUT]: {e}")
+        sys.exit(2)
     except KeyboardInterrupt:
-        # Close the broker with specific `exchange` and `queue_name`.
-        app_section.message_broker.close()
         sys.exit(0)
@@ -0,0 +1,84 @@
+"""Laravel Envelope Micro-benchmark
+
+Compares messages/sec of the legacy per-message envelope builder with the
+precompiled `LaravelEnvelope`. Both produce the same bytes, checked by
+`tests/test_envelope.py`.
+
+```sh
+cd src && python -m bench.envelope [-n <messages>]
+```
+"""
+
+import argparse, json, time
+
+import phpserialize3 as phpSerializer
+
+from data.envelope import LaravelEnvelope
+
+
+NAMESPACE = "App\\Jobs\\SystemLogs\\UltrasonicSensors\\SensorLog"
+DATA = {
+    "ip_address": "192.168.1.10",
+    "sensor_id": "0A",
+    "status": True,
+    "message": [{"level": "info", "content": 1301}],
+}
+JOB_UUID = "0192b0c4-7d1e-7000-8000-000000000001"
+JOB_ID = "0192b0c4-7d1e-7000-8000-000000000002"
+
+
+def legacy_messaging(namespace: str, data: dict, job_uuid: str, job_id: str):
+    """`RabbitMQ.laravel_based_messaging` and `produce` encoding before the
+    precompiled envelope."""
+    stream: dict = {
+        "data": data,
+        "connection": "rabbitmq",
+        "queue": "logs",
+    }
+
+    command: str = phpSerializer.dumps(stream)
+
+    message = {
+        "uuid": job_uuid,
+        "displayName": namespace,
+        "job": "Illuminate\\Queue\\CallQueuedHandler@call",
+        "maxTries": None,
+        "maxExceptions": None,
+        "failOnTimeout": False,
+        "backoff": None,
+        "timeout": None,
+        "retryUntil": None,
+        "data": {
+            "commandName": namespace,
+            "command": f'O:{len(namespace)}:"{namespace}":'
+            + str(len(stream))
+            + ":{s:"
+            + str(6 + len(namespace))
+            + f':"\u0000{namespace}\u0000data";'
+            + command[16:],
+        },
+        "id": job_id,
+    }
+    return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+
+def rate(build, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        build()
+    return count / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Laravel envelope micro-benchmark")
+    parser.add_argument("-n", "--messages", type=int, default=100_000)
+    args = parser.parse_args()
+
+    envelope = LaravelEnvelope(NAMESPACE)
+    before = rate(
+        lambda: legacy_messaging(NAMESPACE, DATA, JOB_UUID, JOB_ID),
+        args.messages,
+    )
+    after = rate(lambda: envelope.render(DATA, JOB_UUID, JOB_ID), args.messages)
+    print(f"Before: {before:,.0f} messages/sec")
+    print(f"After:  {after:,.0f} messages/sec ({after / before:.2f}x)")
@@ -0,0 +1,104 @@
+"""Occupancy History Memory Benchmark
+
+Fills an `OccupancyHistory` with full rings, `--transitions` state changes
+of every sensor and `--samples` counts of every floor over the last day, and
+reports its memory per sensor (`tracemalloc`), the snapshot size and times,
+and the latency of slot and floor queries over the last hour.
+
+```sh
+cd src && python -m bench.history -s 10000 -f 100
+```
+"""
+
+import argparse, os, random, tempfile, time, tracemalloc
+
+from bench.load import percentile
+from data.history import OccupancyHistory
+
+
+BUILDING = "bench"
+DAY = 24 * 3600
+
+
+def fill(sensors: int, floors: int, transitions: int, samples: int):
+    history = OccupancyHistory(transitions, samples)
+    now = time.time()
+    per_floor = sensors // floors
+    for sensor in range(sensors):
+        key = (BUILDING, sensor // per_floor, f"{sensor % per_floor:X}")
+        at = now - DAY
+        for state in range(transitions):
+            at += random.expovariate(transitions / DAY)
+            history.transitions.append(key, min(at, now), (state % 2,))
+
+    for floor in range(floors):
+        free = per_floor
+        for sample in range(samples):
+            free = max(0, min(per_floor, free + random.randint(-3, 3)))
+            history.counts.append(
+                (BUILDING, floor),
+                now - DAY + sample * DAY / samples,
+                (free, per_floor - free, 0, 0),
+            )
+    return history
+
+
+def query_latencies(history: OccupancyHistory, sensors: int, floors: int):
+    per_floor = sensors // floors
+    slots, counts = [], []
+    for _ in range(1000):
+        sensor = random.randrange(sensors)
+        started = time.perf_counter()
+        history.slot(BUILDING, sensor // per_floor, f"{sensor % per_floor:X}")
+        slots.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        history.floor(BUILDING, random.randrange(floors), step=60)
+        counts.append(time.perf_counter() - started)
+    return slots, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Occupancy history benchmark")
+    parser.add_argument("-s", "--sensors", type=int, default=10_000)
+    parser.add_argument("-f", "--floors", type=int, default=100)
+    parser.add_argument("--transitions", type=int, default=64)
+    parser.add_argument("--samples", type=int, default=8640)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    history = fill(args.sensors, args.floors, args.transitions, args.samples)
+    filled = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    slots, counts = query_latencies(history, args.sensors, args.floors)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.bin")
+        started = time.perf_counter()
+        history.save(path)
+        saved = time.perf_counter() - started
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        assert OccupancyHistory(args.transitions, args.samples).load(path)
+        loaded = time.perf_counter() - started
+
+    print(
+        f"{args.sensors} sensors, {args.floors} floors, "
+        f"{args.transitions} transitions, {args.samples} samples "
+        f"(filled in {filled:.1f}s)"
+    )
+    print("memory (MiB) | per sensor (B) | snapshot (MiB) | save/load (ms)")
+    print(
+        f"{memory / 2**20:12.1f} | {memory / args.sensors:14.0f} "
+        f"| {size / 2**20:14.1f} | {saved * 1000:.0f}/{loaded * 1000:.0f}"
+    )
+    print("query       | p50/p99/max (ms)")
+    for name, latencies in (("slot", slots), ("floor, 60s", counts)):
+        print(
+            f"{name:11} | {percentile(latencies, 0.50) * 1000:.3f}"
+            f"/{percentile(latencies, 0.99) * 1000:.3f}"
+            f"/{max(latencies) * 1000:.3f}"
+        )
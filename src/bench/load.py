@@ -0,0 +1,229 @@
+"""End-to-end Load Benchmark
+
+Runs the asyncio `Collector` against simulated gateways with a MongoDB
+stand-in, and the real RabbitMQ outbox and publisher confirms on an
+in-process channel (`LoopbackBroker`), for every gateway count, and reports:
+
++ Floor-scan time (mean and p95)
++ Readings/sec
++ `send_event` latency percentiles (envelope build and queueing into the
+outbox, not the publish)
++ Redis live state writes (pipelined round trips)
++ Published reading latency per stage (`reading_stage_seconds` p50/p99),
+up to `total`: from the sensor request to the broker's confirm
++ Memory per gateway (peak RSS growth of the collector / gateways)
+
+Every scenario runs in fresh simulator and collector processes.
+
+```sh
+cd src && python -m bench.load -g 1 10 100 -s 120 -d 20
+```
+"""
+
+from contextlib import redirect_stdout
+import argparse, asyncio, multiprocessing, os, resource, time
+
+from config import config
+
+
+BUILDING = "bench"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_simulator(gateways: int, sensors: int, port: int, options: dict):
+    from simulator.gateway import serve
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        asyncio.run(serve(gateways, sensors, port, **options))
+
+
+def run_collector(
+    gateways: int,
+    sensors: int,
+    port: int,
+    duration: float,
+    polling: dict,
+    results,
+):
+    # Before polling module reads its defaults
+    config["polling"].update(polling)
+
+    from collector import Collector
+    from data.live import LiveSlotCache
+    import metrics
+    from simulator.fakes import FakeDatabase, FakeRedis, LoopbackBroker
+
+    reports: list = []
+    send_latencies: list[float] = []
+
+    class BenchCollector(Collector):
+        def section(self, *args):
+            app_section = super().section(*args)
+            report_scan, send_event = (
+                app_section.report_scan,
+                app_section.send_event,
+            )
+
+            def timed_report_scan(report):
+                reports.append(report)
+                return report_scan(report)
+
+            def timed_send_event(*args, **kwargs):
+                started = time.perf_counter()
+                send_event(*args, **kwargs)
+                send_latencies.append(time.perf_counter() - started)
+
+            app_section.report_scan = timed_report_scan
+            app_section.send_event = timed_send_event
+            return app_section
+
+    async def collect(collector: Collector):
+        try:
+            await asyncio.wait_for(collector.run(), duration)
+        except TimeoutError:
+            pass
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    broker = LoopbackBroker()
+    redis = FakeRedis()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        asyncio.run(
+            collect(
+                BenchCollector(
+                    "db",
+                    BUILDING,
+                    port,
+                    queue_name="logs",
+                    message_broker=broker,
+                    db_connection=FakeDatabase.simulated(
+                        BUILDING, gateways, sensors, port
+                    ),
+                    live_slots=LiveSlotCache(client=redis),
+                )
+            )
+        )
+        # Waits for the confirms of the outbox
+        broker.close()
+
+    # `ru_maxrss` is KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scan_times = [report.duration for report in reports]
+    results.put(
+        {
+            "gateways": gateways,
+            "scans": len(reports),
+            "scan_mean": sum(scan_times) / len(scan_times) if scan_times else 0,
+            "scan_p95": percentile(scan_times, 0.95),
+            "readings_per_sec": sum(r.responses for r in reports) / duration,
+            "published": sum(broker.published.values()),
+            "redis_writes": redis.executed,
+            "send_p50": percentile(send_latencies, 0.50),
+            "send_p99": percentile(send_latencies, 0.99),
+            "memory_per_gateway": (peak - baseline) / gateways,
+            "stages": {
+                stage: (series.quantile(0.50), series.quantile(0.99))
+                for (stage,), series in metrics.reading_stage_seconds.series.items()
+            },
+        }
+    )
+
+
+def scenario(
+    gateways: int,
+    sensors: int,
+    port: int,
+    duration: float,
+    polling: dict,
+    options: dict,
+) -> dict:
+    simulator = multiprocessing.Process(
+        target=run_simulator,
+        args=(gateways, sensors, port, options),
+        daemon=True,
+    )
+    simulator.start()
+    # Wait for the listening sockets
+    time.sleep(1 + gateways / 100)
+    if not simulator.is_alive():
+        raise RuntimeError(f"Simulator exited on port {port}, is it in use?")
+
+    results = multiprocessing.Queue()
+    collector = multiprocessing.Process(
+        target=run_collector,
+        args=(gateways, sensors, port, duration, polling, results),
+    )
+    collector.start()
+    result = results.get(timeout=duration + 60)
+    collector.join()
+    simulator.terminate()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Collector load benchmark")
+    parser.add_argument(
+        "-g", "--gateways", type=int, nargs="+", default=[1, 10, 100]
+    )
+    parser.add_argument("-s", "--sensors", type=int, default=120)
+    parser.add_argument("-d", "--duration", type=float, default=20)
+    parser.add_argument("-p", "--port", type=int, default=15000)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--churn", type=float, default=0.02)
+    parser.add_argument("--disconnect-rate", type=float, default=0.005)
+    parser.add_argument(
+        "--window", type=int, default=config["polling"]["window"]
+    )
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument(
+        "--frame-spacing",
+        type=float,
+        default=config["polling"]["frame_spacing"],
+    )
+    args = parser.parse_args()
+
+    # Every sensor due every `--interval` seconds without a bus budget, so
+    # readings/sec shows the collector's limit.
+    polling = {
+        "window": args.window,
+        "frame_spacing": args.frame_spacing,
+        "sensor_spacing": 0,
+        "min_interval": args.interval,
+        "max_interval": args.interval,
+        "disconnected_interval": args.interval,
+        "budget": 0,
+    }
+    options = {
+        "latency": args.latency,
+        "churn": args.churn,
+        "disconnect_rate": args.disconnect_rate,
+    }
+
+    print(
+        "gateways | scans | scan mean/p95 (s) | readings/s | published "
+        "| send_event p50/p99 (ms) | Redis writes | KiB/gateway"
+    )
+    for gateways in args.gateways:
+        r = scenario(
+            gateways, args.sensors, args.port, args.duration, polling, options
+        )
+        print(
+            f"{r['gateways']:8} | {r['scans']:5} "
+            f"| {r['scan_mean']:.3f}/{r['scan_p95']:.3f} "
+            f"| {r['readings_per_sec']:10.0f} | {r['published']:9} "
+            f"| {r['send_p50'] * 1000:.3f}/{r['send_p99'] * 1000:.3f} "
+            f"| {r['redis_writes']:12} "
+            f"| {r['memory_per_gateway']:.0f}"
+        )
+        print(
+            "         stage p50/p99 (ms): "
+            + ", ".join(
+                f"{stage} {p50 * 1000:.3f}/{p99 * 1000:.3f}"
+                for stage, (p50, p99) in r["stages"].items()
+            )
+        )
@@ -0,0 +1,134 @@
+"""RFID Tag-to-Publish Latency Benchmark
+
+Runs the RFID section against a simulated reader with in-process broker and
+MongoDB stand-ins, and reports the latency from the first read of a car's tag
+on the reader to its published event (p50/p95/p99/max), against `--target`.
+
+Half of the tags are registered, and every car's tag is read `--repeats`
+times, so deduplication is part of the measured path.
+
+```sh
+cd src && python -m bench.rfid -d 20 --rate 20
+```
+"""
+
+from contextlib import redirect_stdout
+import argparse, asyncio, os, threading, time
+
+from bench.load import percentile
+
+
+BUILDING = "bench"
+
+
+def run_reader(port: int, tags: list[str], options: dict, sent: dict):
+    from simulator.reader import serve_reader
+
+    def record(tag: str, at: float):
+        sent.setdefault(tag, []).append(at)
+
+    asyncio.run(serve_reader("127.0.0.1", port, tags, sent=record, **options))
+
+
+def run(tags: int, port: int, duration: float, options: dict) -> dict:
+    from data.controllers import Controllers
+    from sections import AppSections
+    from simulator.fakes import FakeBroker, FakeDatabase
+
+    tag_names = [f"E2000017{index:08X}" for index in range(tags)]
+    sent: dict[str, list[float]] = {}
+    published: dict[str, list[float]] = {}
+
+    reader = threading.Thread(
+        target=run_reader,
+        args=(port, tag_names, options, sent),
+        name="reader",
+        daemon=True,
+    )
+    reader.start()
+    # Wait for the listening socket
+    time.sleep(1)
+
+    database = FakeDatabase(
+        [],
+        [],
+        [
+            {"building": BUILDING, "tag": tag, "card": index}
+            for index, tag in enumerate(tag_names[::2])
+        ],
+    )
+    app_section = AppSections(
+        "127.0.0.1",
+        port,
+        BUILDING,
+        "logs",
+        message_broker=FakeBroker(),
+        sensor_collections=Controllers(
+            BUILDING, "127.0.0.1", db_connection=database
+        ),
+        section="rfid",
+    )
+    send_event = app_section.send_event
+
+    def timed_send_event(data: dict, *args, **kwargs):
+        send_event(data, *args, **kwargs)
+        published.setdefault(data["tag"], []).append(time.monotonic())
+
+    app_section.send_event = timed_send_event
+    threading.Thread(
+        target=app_section.socket_connection,
+        args=(app_section.get_rfid_data,),
+        name="rfid",
+        daemon=True,
+    ).start()
+    time.sleep(duration)
+
+    # First read of every car to its publish, in order per tag.
+    latencies = [
+        at - sent_at
+        for tag, published_at in published.items()
+        for sent_at, at in zip(sent.get(tag, []), published_at)
+    ]
+    return {
+        "cars": sum(len(times) for times in sent.values()),
+        "published": sum(len(times) for times in published.values()),
+        "duplicates": app_section.tag_reads.duplicates,
+        "latencies": latencies,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="RFID latency benchmark")
+    parser.add_argument("-t", "--tags", type=int, default=1000)
+    parser.add_argument("-d", "--duration", type=float, default=20)
+    parser.add_argument("-p", "--port", type=int, default=15100)
+    parser.add_argument("--rate", type=float, default=5.0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--repeat-spacing", type=float, default=0.05)
+    parser.add_argument("--target", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        r = run(
+            args.tags,
+            args.port,
+            args.duration,
+            {
+                "rate": args.rate,
+                "repeats": args.repeats,
+                "repeat_spacing": args.repeat_spacing,
+            },
+        )
+
+    latencies = r["latencies"]
+    worst = max(latencies, default=0.0)
+    print("cars | published | duplicates | p50/p95/p99/max (ms) | target")
+    print(
+        f"{r['cars']:4} | {r['published']:9} | {r['duplicates']:10} "
+        f"| {percentile(latencies, 0.50) * 1000:.2f}"
+        f"/{percentile(latencies, 0.95) * 1000:.2f}"
+        f"/{percentile(latencies, 0.99) * 1000:.2f}"
+        f"/{worst * 1000:.2f} "
+        f"| {'met' if percentile(latencies, 0.99) <= args.target else 'missed'}"
+        f" ({args.target * 1000:.0f} ms)"
+    )
@@ -0,0 +1,230 @@
+import asyncio, json, socket
+
+from config import config
+from data.controllers import (
+    Controllers,
+    TopologyCache,
+    TopologyUnavailable,
+    mongo_connection,
+)
+from data.history import OccupancyHistory, occupancy_history, save_history
+from data.live import LiveSlotCache, live_slot_cache
+from data.models import GatewayConfig, SensorsLogging
+from data import mq
+from logger import get_logger
+from polling import AsyncSensorPoller
+from sections import AppSections, log_socket_error
+
+
+log = get_logger(__name__)
+
+
+def load_gateways(source: str, controllers: Controllers, port: int | None):
+    """Loads gateways of the collector.
+
+    Args:
+        source (str): `db` to use active gateways of the building from
+        `GateWay` collection, otherwise path of a JSON file such as:
+        `[{"building": "vanak", "ip": "192.168.1.10", "port": 4001}]`.
+        controllers (Controllers): Controllers of the default building.
+        port (int): Default port number of the gateways, those without any
+        valid port are skipped.
+    Return: List of `GatewayConfig`.
+    """
+    if source == "db":
+        gateways = controllers.get_gateways()
+    else:
+        with open(source) as gateways_file:
+            gateways = json.load(gateways_file)
+
+    configs = []
+    for gateway in gateways:
+        try:
+            gateway_port = int(gateway.get("port") or port)
+        except (TypeError, ValueError):
+            log.warning(
+                "Gateway %s has no valid port, skipped.",
+                gateway["ip"],
+                code="COLLECTOR",
+                fields={"port": gateway.get("port")},
+            )
+            continue
+
+        configs.append(
+            GatewayConfig(
+                building=gateway.get("building", controllers.building),
+                ip=gateway["ip"],
+                port=gateway_port,
+            )
+        )
+    return configs
+
+
+class Collector:
+    """Asyncio Multi-gateway Sensors Collector
+
+    Drives every gateway socket from one event loop, while the MongoDB pool,
+    the topology cache, the RabbitMQ connection, the Redis live slot cache and
+    the occupancy history are shared by all of them. Publishing only queues
+    into the broker's outbox and the cache's batch, so the event loop never
+    blocks on RabbitMQ or Redis.
+
+    Args:
+        source (str): `db` or gateways JSON file, see `load_gateways`.
+        gateways (list[GatewayConfig]): Gateways to collect instead of
+        loading them from `source`, e.g. gateways of a shard.
+        snapshot_path (str): Occupancy history snapshot, loaded on start and
+        saved on `close`.
+    """
+
+    queue_route: str = "logs.utlrasonic-sensors"
+    queue_namespace_provider: str = (
+        "App\\Jobs\\SystemLogs\\UltrasonicSensors\\SensorLog"
+    )
+
+    def __init__(
+        self,
+        source: str,
+        building: str,
+        port: int | None,
+        queue_name: str,
+        message_broker: mq.RabbitMQ | None = None,
+        db_connection=None,
+        gateways: list[GatewayConfig] | None = None,
+        live_slots: LiveSlotCache | None = None,
+        history: OccupancyHistory | None = None,
+        snapshot_path: str = config["history"]["snapshot_path"],
+    ):
+        self.queue_name = queue_name
+        self.message_broker = message_broker or mq.RabbitMQ()
+        self.live_slots = live_slots or live_slot_cache()
+        self.snapshot_path = snapshot_path
+        self.history = history or occupancy_history(snapshot_path)
+
+        if db_connection is None:
+            db_connection = mongo_connection()
+        topology = TopologyCache(
+            db_connection, config["db"]["mongo"]["topology_ttl"]
+        )
+        topology.watch()
+        self.gateways = (
+            gateways
+            if gateways is not None
+            else load_gateways(
+                source,
+                Controllers(
+                    building, None, db_connection=db_connection, topology=topology
+                ),
+                port,
+            )
+        )
+        self.sections: list[AppSections] = [
+            self.section(gateway, db_connection, topology)
+            for gateway in self.gateways
+        ]
+
+    def section(
+        self, gateway: GatewayConfig, db_connection, topology: TopologyCache
+    ) -> AppSections:
+        app_section = AppSections(
+            gateway.ip,
+            gateway.port,
+            gateway.building,
+            queue_name=self.queue_name,
+            message_broker=self.message_broker,
+            sensor_collections=Controllers(
+                gateway.building,
+                gateway.ip,
+                db_connection=db_connection,
+                topology=topology,
+            ),
+            live_slots=self.live_slots,
+            history=self.history,
+        )
+        app_section.queue_route = self.queue_route
+        app_section.queue_namespace_provider = self.queue_namespace_provider
+        return app_section
+
+    async def run(self):
+        log.info("Collecting %s gateways.", len(self.sections), code="COLLECTOR")
+        await asyncio.gather(
+            *(self.collect(app_section) for app_section in self.sections)
+        )
+
+    def close(self):
+        for app_section in self.sections:
+            stats = app_section.supervisor.stats
+            if stats.failures:
+                log.info(
+                    "%s had %s failures, %.1fs downtime",
+                    app_section.supervisor.name,
+                    stats.failures,
+                    stats.downtime,
+                    code="SUPERVISOR",
+                )
+        self.message_broker.close()
+        if self.live_slots:
+            self.live_slots.close()
+        save_history(self.history, self.snapshot_path)
+
+    async def collect(self, app_section: AppSections):
+        """Async variant of `AppSections.socket_connection` and
+        `AppSections.get_sensors_data` for one gateway.
+
+        A failed gateway waits out its own supervisor backoff in the event
+        loop, so it never delays the healthy gateways.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.setblocking(False)
+            try:
+                await asyncio.wait_for(
+                    loop.sock_connect(client, (app_section.ip, app_section.port)),
+                    config["polling"]["response_timeout"],
+                )
+                app_section.metrics.connects.inc()
+                await self.get_sensors_data(app_section, client)
+                return
+            except OSError as socket_error:
+                app_section.metrics.error(socket_error)
+                log_socket_error(socket_error, app_section.ip)
+            finally:
+                client.close()
+
+            await asyncio.sleep(app_section.supervisor.failed())
+
+    async def get_sensors_data(
+        self, app_section: AppSections, client: socket.socket
+    ):
+        sensor_logging: SensorsLogging = SensorsLogging(None, None, None)
+        poller = AsyncSensorPoller(
+            client, response_seconds=app_section.metrics.response_seconds
+        )
+
+        while True:
+            # Served from the topology cache, a refresh hits MongoDB.
+            try:
+                topology = await asyncio.to_thread(
+                    app_section.sensor_collections.get_topology
+                )
+            except TopologyUnavailable as e:
+                log.warning("%s Retrying.", e, code="MONGODB")
+                await asyncio.sleep(config["db"]["mongo"]["topology_retry"])
+                continue
+
+            if topology.floor == None:
+                app_section.send_floor_not_found(sensor_logging)
+                break
+
+            due = app_section.due_sensors(topology.floor, topology.sensors)
+            if not due:
+                await asyncio.sleep(app_section.idle_time())
+                continue
+
+            async for sensor_id, state in poller.scan(due, floor=topology.floor):
+                app_section.handle_sensor_response(
+                    sensor_logging, sensor_id, state, poller.read_at
+                )
+            app_section.report_scan(poller.last_scan)
@@ -1,10 +1,99 @@
+import json, os
+
+
 config: dict = {
     "client_commands": {
         "sensor_read": "03000A0005",
+        "sensor_response_length": 15,
         "barrier": {
             "read": "",
             "open": "",
+            "close": "",
+            # Commands are consumed from `{queue}.{building}.{ip}` queue,
+            # bound with `{route}.{building}.{ip}` routing key.
+            "queue": "barrier-commands",
+            "route": "commands.barriers",
+            "prefetch": 32,
+            "command_timeout": 2.0,
+            # Pending commands per barrier, oldest is rejected when it's full
+            "max_in_flight": 4,
+            # Commands waiting longer are not executed
+            "max_age": 10.0,
         },
+        "rfid": {
+            "delimiter": "\r\n",
+            "max_frame_length": 64,
+            # Repeated reads of a tag in this many seconds are dropped
+            "dedup_window": 5.0,
+            # Scalar fields of the `RFID` document published as a read's card
+            "card_fields": ["tag", "card", "plate", "owner"],
+        },
+    },
+    "polling": {
+        "window": 4,
+        "frame_spacing": 0.02,
+        "sensor_spacing": 1.0,
+        "response_timeout": 2.0,
+        "silence_timeout": 10.0,
+        "heartbeat": 300,
+        "min_interval": 1.0,
+        "max_interval": 30.0,
+        "disconnected_interval": 60.0,
+        # Unanswered polls in a row before a sensor is polled as disconnected
+        "max_misses": 3,
+        "transitions_per_poll": 0.02,
+        "rate_window": 600.0,
+        "budget": 20.0,
+    },
+    "supervisor": {
+        "backoff_base": 1.0,
+        "backoff_max": 60.0,
+        "failure_threshold": 5,
+        "open_timeout": 120.0,
+    },
+    "occupancy": {
+        "route": "logs.floor-occupancy",
+        "namespace": "App\\Jobs\\SystemLogs\\UltrasonicSensors\\FloorOccupancy",
+        "interval": 60,
+        "on_change": True,
+    },
+    "shards": {
+        # `0` for one shard per CPU core
+        "workers": 0,
+        "health_interval": 5.0,
+        "heartbeat_timeout": 30.0,
+        "refresh_interval": 60.0,
+    },
+    "logging": {
+        "level": "INFO",
+        # `json` or `text`
+        "format": "json",
+        "levels": {"pika": "WARNING", "pymongo": "WARNING"},
+        # Seconds between repeats of the same warning or error
+        "rate_limit": 60.0,
+        "queue_size": 10000,
+        # Log every published message body
+        "payloads": False,
+    },
+    "metrics": {
+        "host": "127.0.0.1",
+        "port": 9108,
+        "profile_signal": "SIGUSR2",
+        "profile_interval": 0.01,
+        "profile_path": "profile.folded",
+    },
+    "tracing": {
+        # Adds the `trace` timestamps of the reading's stages to sensor events
+        "payload": False,
+    },
+    "history": {
+        # Last state changes kept per sensor
+        "transitions": 64,
+        # Last counts kept per floor, a day of 10 seconds samples
+        "samples": 8640,
+        "sample_interval": 10.0,
+        # Snapshot loaded on start and saved on shutdown, empty to disable it
+        "snapshot_path": "",
     },
     "sections": [
         "sensors",
@@ -16,21 +105,141 @@ config: dict = {
         "huawei",
         "setareh",
     ],
+    "service": {
+        # Set up front for daemon mode (options, environment or config file),
+        # otherwise the building is asked at the terminal.
+        "building": None,
+        "section": None,
+        "ip": None,
+        "port": None,
+        "gateways": None,
+        "workers": None,
+        # Created once the section is running and removed on exit, for
+        # orchestrator readiness probes
+        "ready_file": "",
+    },
     "options": {
         "--ip": "-i",
         "--port": "-p",
         "--section": "-s",
+        "--gateways": "-g",
+        "--workers": "-w",
+        "--building": "-b",
+        "--config": "-c",
+    },
+    # Environment variables of `load_config`, by their config keys
+    "environment": {
+        "MCI_BUILDING": ("service", "building"),
+        "MCI_SECTION": ("service", "section"),
+        "MCI_IP": ("service", "ip"),
+        "MCI_PORT": ("service", "port"),
+        "MCI_GATEWAYS": ("service", "gateways"),
+        "MCI_WORKERS": ("service", "workers"),
+        "MCI_READY_FILE": ("service", "ready_file"),
+        "MCI_MQ_HOST": ("mq", "host"),
+        "MCI_MQ_PORT": ("mq", "port"),
+        "MCI_MQ_USER": ("mq", "user"),
+        "MCI_MQ_PASSWORD": ("mq", "password"),
+        "MCI_MONGO_URL": ("db", "mongo", "connection_string"),
+        "MCI_REDIS_URL": ("db", "redis", "url"),
+        "MCI_LOG_LEVEL": ("logging", "level"),
+        "MCI_LOG_FORMAT": ("logging", "format"),
+        "MCI_METRICS_PORT": ("metrics", "port"),
+        "MCI_HISTORY_SNAPSHOT": ("history", "snapshot_path"),
+        "MCI_TRACE_PAYLOAD": ("tracing", "payload"),
     },
     "mq": {
         "user": "message_broker",
         "password": "1234",
         "host": "127.0.0.1",
         "port": 5672,
+        "exchange": "system-logs",
+        # Only checked to exist when passive, the broker's own exchange is
+        # never redeclared. Otherwise declared with this type and durability.
+        "exchange_passive": True,
+        "exchange_type": "topic",
+        "exchange_durable": True,
+        "connect_timeout": 10,
+        "outbox": {
+            "max_size": 10000,
+            "overflow": "drop_oldest",
+            "batch_size": 100,
+            "flush_interval": 0.2,
+        },
+        "spool": {
+            # Suffixed by `.{ip}-{port}` for a section's process and by
+            # `.{index}` for a shard, one spool per process
+            "directory": "spool",
+            "segment_size": 8 * 1024 * 1024,
+            "max_bytes": 512 * 1024 * 1024,
+        },
     },
     "db": {
         "mongo": {
             "connection_string": "mongodb://localhost:27017/MCI_PCR_DB",
+            "topology_ttl": 300,
+            # Seconds between retries of a topology that couldn't be loaded
+            "topology_retry": 5.0,
+            "tag_ttl": 300,
+        },
+        "redis": {
+            # Live slot state cache, empty to disable it
+            "url": "redis://localhost:6379/0",
+            "prefix": "parking",
+            "flush_interval": 0.2,
+            "socket_timeout": 1.0,
         },
-        "redis": {},
     },
 }
+
+
+def load_config(path: str | None = None, environ: dict = os.environ):
+    """Updates `config` from a JSON file and then from the environment
+    variables of `config["environment"]`.
+
+    Modules read their defaults from `config` when they're imported, so it
+    must run before them. It runs on import with the `MCI_CONFIG` file.
+
+    Args:
+        path (str): JSON file of the keys to override, e.g.
+        `{"service": {"building": "vanak", "section": "sensors"}}`.
+    """
+    if path:
+        with open(path) as config_file:
+            merge(config, json.load(config_file))
+
+    for variable, keys in config["environment"].items():
+        value = environ.get(variable)
+        if value is None:
+            continue
+
+        *parents, key = keys
+        section = config
+        for parent in parents:
+            section = section[parent]
+        section[key] = parse(value, section.get(key))
+
+
+def merge(target: dict, source: dict):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def parse(value: str, default):
+    """Environment variable as the type of its default."""
+    match default:
+        case bool():
+            return value.lower() in ("1", "true", "yes", "on")
+        case int():
+            return int(value)
+        case float():
+            return float(value)
+        case _:
+            return value
+
+
+# Every process, e.g. spawned shard workers, loads the same overrides.
+load_config(os.environ.get("MCI_CONFIG"))
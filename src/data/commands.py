@@ -0,0 +1,72 @@
+from collections import deque
+import threading
+
+from data.models import BarrierCommand
+
+
+class BarrierCommandQueue:
+    """Bounded Queues of Pending Barrier Commands
+
+    Commands are queued per barrier, up to `max_in_flight` each, and taken
+    round-robin across barriers, so a busy lane doesn't delay the others.
+    When a barrier's queue is full, its oldest command is superseded and
+    moved to `rejected`, to be reported by the consumer thread.
+
+    `put` and `clear` never block, they're called by the broker's I/O
+    thread.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.pending: dict[str, deque[BarrierCommand]] = {}
+        # Barriers with pending commands, next one first
+        self.ready: deque[str] = deque()
+        self.rejected: deque[BarrierCommand] = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return sum(len(commands) for commands in self.pending.values())
+
+    def put(self, command: BarrierCommand) -> bool:
+        """Queues a command and returns `False` if an older one of the
+        barrier is rejected for it."""
+        with self._condition:
+            commands = self.pending.setdefault(command.barrier, deque())
+            if not commands:
+                self.ready.append(command.barrier)
+
+            accepted = len(commands) < self.max_in_flight
+            if not accepted:
+                self.rejected.append(commands.popleft())
+            commands.append(command)
+            self._condition.notify()
+            return accepted
+
+    def take(self, timeout: float) -> BarrierCommand | None:
+        """Next command of the next barrier, `None` after `timeout` seconds
+        without any command."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.ready, timeout):
+                return None
+
+            barrier = self.ready.popleft()
+            commands = self.pending[barrier]
+            command = commands.popleft()
+            if commands:
+                self.ready.append(barrier)
+            return command
+
+    def clear(self) -> int:
+        """Drops every pending and rejected command, returns their count."""
+        with self._condition:
+            dropped = len(self) + len(self.rejected)
+            self.pending.clear()
+            self.ready.clear()
+            self.rejected.clear()
+            return dropped
+
+    def take_rejected(self) -> list[BarrierCommand]:
+        with self._condition:
+            rejected = list(self.rejected)
+            self.rejected.clear()
+            return rejected
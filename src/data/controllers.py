@@ -1,62 +1,371 @@
+import math, threading, time
+
 from pymongo import MongoClient
 from pymongo.errors import (
     ServerSelectionTimeoutError,
     ConfigurationError,
     InvalidOperation,
+    OperationFailure,
+    PyMongoError,
 )
 
 from config import config
+from data.models import GatewayTopology
+from logger import get_logger
+import metrics
+
+
+log = get_logger(__name__)
+
+
+class TopologyUnavailable(Exception):
+    """Topology couldn't be loaded and none is cached, unlike a gateway
+    without any floor, so it's retried later."""
+
+
+class TopologyCache:
+    """Gateway's Floor and Slot Topology Cache
+
+    Keeps the floor and the ordered sensor ids of every `(building, ip)`
+    gateway in memory, so the polling loop doesn't query MongoDB on every
+    cycle.
+
+    Entries are invalidated by a change stream on the `watched_fields` of
+    `GateWay` and `Slot` collections. When change streams are not available
+    (e.g. standalone MongoDB server), entries are refreshed after `ttl`
+    seconds. Invalidated and expired entries are kept, and served while
+    MongoDB is failing.
+    """
+
+    # Fields of every collection the topology depends on
+    watched_fields: dict[str, list[str]] = {
+        "GateWay": ["building", "ip", "port", "Status", "floor"],
+        "Slot": ["building", "floor", "id"],
+    }
+
+    def __init__(self, db_connection, ttl: float):
+        self.db_connection = db_connection
+        self.ttl = ttl
+        self._entries: dict[tuple[str, str], tuple[GatewayTopology, float]] = {}
+        # Incremented by every invalidation
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._watcher: threading.Thread | None = None
+
+    def get(self, building: str, ip: str) -> GatewayTopology:
+        """Returns cached topology of the gateway and loads it when it's
+        missing, expired or invalidated.
+
+        Raises:
+            TopologyUnavailable: MongoDB failed and nothing is cached.
+        """
+        entry = self._entries.get((building, ip))
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        generation = self._generation
+        topology = self._load(building, ip)
+        if topology is None:
+            # Keep serving the stale topology while MongoDB is failing.
+            if entry:
+                return entry[0]
+            raise TopologyUnavailable(f"Topology of {building} {ip} is not loaded.")
+
+        with self._lock:
+            # Invalidated while loading, the result may predate the change and
+            # is cached as invalidated, only as a fallback.
+            fresh = generation == self._generation
+            self._entries[(building, ip)] = (
+                topology,
+                time.monotonic() if fresh else -math.inf,
+            )
+        return topology
+
+    def invalidate(self, building: str | None = None):
+        """Marks cached entries of a building, or every entry if building is
+        not specified, to be reloaded on their next `get`."""
+        with self._lock:
+            self._generation += 1
+            for key, (topology, _) in list(self._entries.items()):
+                if building is None or key[0] == building:
+                    self._entries[key] = (topology, -math.inf)
+
+    def watch(self):
+        """Starts the change stream listener in background."""
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        self._watcher = threading.Thread(
+            target=self._watch_changes, name="topology-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def _load(self, building: str, ip: str) -> GatewayTopology | None:
+        try:
+            started = time.perf_counter()
+            gateway = self.db_connection.GateWay.find_one(
+                {"building": building, "Status": 1, "ip": ip},
+                projection={"floor": 1, "_id": 0},
+            )
+            floor = gateway.get("floor") if gateway else None
+            observe_query("GateWay", "find_one", started)
+            if floor is None:
+                return GatewayTopology(None, ())
+
+            started = time.perf_counter()
+            slots = self.db_connection.Slot.find(
+                {"building": building, "floor": floor},
+                projection={"id": 1, "_id": 0},
+                sort=[("id", 1)],
+            )
+            topology = GatewayTopology(floor, tuple(slot["id"] for slot in slots))
+            observe_query("Slot", "find", started)
+            return topology
+        except InvalidOperation as e:
+            metrics.mongo_errors.labels(type(e).__name__).inc()
+            log.error(
+                "Invalid operation to find entered floor number.",
+                code="MONGODB",
+                fields={"gateway": ip},
+            )
+        except Exception as e:
+            metrics.mongo_errors.labels(type(e).__name__).inc()
+            log.error(
+                "Topology query failed. %s", e, code="MONGODB", fields={"gateway": ip}
+            )
+
+    def changes_pipeline(self) -> list[dict]:
+        """Matches inserted, deleted and replaced documents of the watched
+        collections, and updates that set or remove a watched field."""
+        updates = [
+            {
+                "operationType": "update",
+                "ns.coll": collection,
+                "$or": [
+                    {f"updateDescription.updatedFields.{field}": {"$exists": True}}
+                    for field in fields
+                ]
+                + [{"updateDescription.removedFields": {"$in": fields}}],
+            }
+            for collection, fields in self.watched_fields.items()
+        ]
+        return [
+            {
+                "$match": {
+                    "$or": [
+                        {
+                            "operationType": {"$in": ["insert", "delete", "replace"]},
+                            "ns.coll": {"$in": list(self.watched_fields)},
+                        },
+                        *updates,
+                    ]
+                }
+            }
+        ]
+
+    def _watch_changes(self):
+        pipeline = self.changes_pipeline()
+        resume_token = None
+
+        while True:
+            try:
+                with self.db_connection.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                ) as stream:
+                    # Changes may be lost while the stream was down.
+                    self.invalidate()
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self.invalidate(changed_building(change))
+            except OperationFailure as e:
+                log.warning(
+                    "Change stream is not supported, topology is refreshed every %ss. %s",
+                    self.ttl,
+                    e,
+                    code="MONGODB",
+                )
+                return
+            except PyMongoError as e:
+                log.warning("Change stream interrupted. %s", e, code="MONGODB")
+                resume_token = None
+                time.sleep(3)
+
+
+class TagIndex:
+    """In-memory Index of a Building's Registered RFID Tags
+
+    Maps upper-case tags to their cards, the scalar `fields` of their `RFID`
+    collection documents, so a tag read is resolved without any database
+    round trip and its card is always serializable. The index is loaded once
+    by `start` and then reloaded in background every `ttl` seconds.
+    """
+
+    collection: str = "RFID"
+
+    def __init__(
+        self,
+        db_connection,
+        building: str,
+        ttl: float,
+        fields: list[str] = config["client_commands"]["rfid"]["card_fields"],
+    ):
+        self.db_connection = db_connection
+        self.building = building
+        self.ttl = ttl
+        self.fields = fields
+        self.tags: dict[str, dict] = {}
+        self._refresher: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def get(self, tag: str) -> dict | None:
+        return self.tags.get(tag)
+
+    def start(self):
+        if self._refresher and self._refresher.is_alive():
+            return
+
+        self.load()
+        self._refresher = threading.Thread(
+            target=self._refresh, name="tag-index", daemon=True
+        )
+        self._refresher.start()
+
+    def load(self) -> bool:
+        try:
+            started = time.perf_counter()
+            documents = self.db_connection[self.collection].find(
+                {"building": self.building},
+                projection={"_id": 0, "tag": 1, **dict.fromkeys(self.fields, 1)},
+            )
+            # Swapped at once, readers never see a partial index.
+            self.tags = {
+                str(document["tag"]).upper(): self.card(document)
+                for document in documents
+                if document.get("tag")
+            }
+            observe_query(self.collection, "find", started)
+            return True
+        except PyMongoError as e:
+            metrics.mongo_errors.labels(type(e).__name__).inc()
+            log.error("RFID tags are not loaded. %s", e, code="MONGODB")
+            return False
+
+    def card(self, document: dict) -> dict:
+        # E.g. dates and ObjectIds of the document are not serializable.
+        return {
+            field: document[field]
+            for field in self.fields
+            if isinstance(document.get(field), (str, int, float, bool))
+        }
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.ttl)
+            self.load()
+
+
+def changed_building(change: dict) -> str | None:
+    """Building of a changed document, `None` when the change may touch
+    another building (e.g. a deleted or moved document)."""
+    updated = change.get("updateDescription", {}).get("updatedFields", {})
+    if "building" in updated:
+        return None
+    return (change.get("fullDocument") or {}).get("building")
+
+
+def observe_query(collection: str, operation: str, started: float):
+    metrics.mongo_query_seconds.labels(collection, operation).observe(
+        time.perf_counter() - started
+    )
+
+
+def mongo_connection():
+    """Opens the MongoDB connection pool and returns the application database.
+
+    One connection can be shared by every `Controllers` of the process.
+    """
+    connection_string = MongoClient(
+        config["db"]["mongo"]["connection_string"],
+        maxPoolSize=20,
+        minPoolSize=5,
+    )
+    return connection_string.MCI_PCR_DB
 
 
 class Controllers:
-    def __init__(self, building: str, ip: str):
+    def __init__(
+        self,
+        building: str,
+        ip: str,
+        db_connection=None,
+        topology: TopologyCache | None = None,
+    ):
         self.building = building
         self.ip = ip
 
         try:
-            self.connection_string = MongoClient(
-                config["db"]["mongo"]["connection_string"],
-                maxPoolSize=20,
-                minPoolSize=5,
+            self.db_connection = (
+                mongo_connection() if db_connection is None else db_connection
+            )
+            # Its change stream is started by the sensors sections using it
+            self.topology = topology or TopologyCache(
+                self.db_connection, config["db"]["mongo"]["topology_ttl"]
             )
-            self.db_connection = self.connection_string.MCI_PCR_DB
         except ServerSelectionTimeoutError:
-            print("[MONGODB]: Server not available")
+            log.critical("Server not available", code="MONGODB")
         except ConfigurationError:
-            print("[MONGODB]: Config error")
+            log.critical("Config error", code="MONGODB")
+
+    def get_topology(self) -> GatewayTopology:
+        """Floor and ordered sensor ids of this gateway, from cache.
+
+        Raises:
+            TopologyUnavailable: See `TopologyCache.get`.
+        """
+        return self.topology.get(self.building, self.ip)
 
     def get_floors(self) -> int:
         """Selects a gateway by IP address and get its floor"""
+        return self.get_topology().floor
 
-        try:
-            gateway = self.db_connection.GateWay.find_one(
-                {"building": self.building, "Status": 1, "ip": self.ip}
+    def get_sensors(self) -> tuple[str, ...]:
+        topology = self.get_topology()
+        if topology.floor == None:
+            log.error(
+                "Floor not found for this building name and IP address.",
+                code="SENSOR",
+                fields={"building": self.building, "gateway": self.ip},
             )
-            return gateway.get("floor") if gateway else None
-        except InvalidOperation:
-            print("[MONGODB]: Invalid operation to find entered floor number.")
-        except Exception as e:
-            print(e)
-
-    def get_sensors(self):
-        if self.get_floors() == None:
-            print("[SENSOR]: Floor not found for this building name and IP address.")
         else:
-            return self.db_connection.Slot.find(
-                {
-                    "building": self.building,
-                    "floor": self.get_floors(),
-                },
-                sort=[("id", 1)],
-            )
+            return topology.sensors
 
     def get_sensors_count(self) -> int:
-        if self.get_floors() == None:
-            print("[SENSOR]: Floor not found for this building name and IP address.")
-        else:
-            try:
-                return self.db_connection.Slot.count_documents(
-                    {"building": self.building, "floor": self.get_floors()}
+        return len(self.get_topology().sensors)
+
+    def get_gateways(self) -> list[dict]:
+        """Active gateways of the building with their `ip` and `port`.
+
+        Raises:
+            PyMongoError: Gateways couldn't be loaded, unlike a building
+            without any active gateway.
+        """
+        try:
+            started = time.perf_counter()
+            gateways = list(
+                self.db_connection.GateWay.find(
+                    {"building": self.building, "Status": 1},
+                    projection={"ip": 1, "port": 1, "_id": 0},
                 )
-            except:
-                return 0
+            )
+            observe_query("GateWay", "find", started)
+            return gateways
+        except InvalidOperation as e:
+            metrics.mongo_errors.labels(type(e).__name__).inc()
+            log.error(
+                "Invalid operation to find building gateways.", code="MONGODB"
+            )
+            raise
@@ -0,0 +1,75 @@
+import json
+
+import phpserialize3 as phpSerializer
+import uuid_utils as uuid
+
+
+class LaravelEnvelope:
+    """Precompiled Laravel Job Envelope
+
+    Laravel queue worker expects a JSON job whose `data.command` is the
+    PHP-serialized job object:
+
+    `O:<len>:"<namespace>":3:{s:<len>:"\\0<namespace>\\0data";<data>...}`
+
+    Everything except the job ids and the serialized `data` is fixed per
+    namespace, so it's built once (already JSON-escaped) and every message
+    only splices the per-reading parts in.
+
+    Args:
+        namespace (str): Laravel MQ directory namespace
+        connection (str): Laravel queue connection
+        queue (str): Laravel queue name
+    """
+
+    def __init__(
+        self, namespace: str, connection: str = "rabbitmq", queue: str = "logs"
+    ):
+        self.namespace = namespace
+
+        stream: dict = {"data": None, "connection": connection, "queue": queue}
+        serialized: str = phpSerializer.dumps(stream)
+        stream_tail: str = serialized[
+            len('a:3:{s:4:"data";') + len(phpSerializer.dumps(None)) :
+        ]
+        command_head: str = (
+            f'O:{len(namespace)}:"{namespace}":{len(stream)}:{{s:'
+            + str(6 + len(namespace))
+            + f':"\u0000{namespace}\u0000data";'
+        )
+
+        static: str = json.dumps(
+            {
+                "displayName": namespace,
+                "job": "Illuminate\\Queue\\CallQueuedHandler@call",
+                "maxTries": None,
+                "maxExceptions": None,
+                "failOnTimeout": False,
+                "backoff": None,
+                "timeout": None,
+                "retryUntil": None,
+            },
+            separators=(",", ":"),
+        )
+        # The command's JSON string is split around `data`, so `middle` has
+        # no closing quote and `tail` has no opening quote.
+        self.head: str = '{"uuid":"'
+        self.middle: str = (
+            '",'
+            + static[1:-1]
+            + ',"data":{"commandName":'
+            + json.dumps(namespace)
+            + ',"command":'
+            + json.dumps(command_head)[:-1]
+        )
+        self.tail: str = json.dumps(stream_tail)[1:] + '},"id":"'
+
+    def render(self, data: dict, job_uuid: str, job_id: str) -> bytes:
+        """Compact JSON job of `data` with the given ids."""
+        command: str = json.dumps(phpSerializer.dumps(data))[1:-1]
+        return "".join(
+            (self.head, job_uuid, self.middle, command, self.tail, job_id, '"}')
+        ).encode("utf-8")
+
+    def build(self, data: dict) -> bytes:
+        return self.render(data, str(uuid.uuid4()), str(uuid.uuid4()))
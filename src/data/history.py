@@ -0,0 +1,328 @@
+from array import array
+import json, math, os, struct, threading, time
+
+from config import config
+from data.models import SensorState
+from logger import get_logger
+import metrics
+
+
+log = get_logger(__name__)
+
+
+class RingBuffers:
+    """Array-backed Ring Buffers by Key
+
+    Every key has `capacity` entries of epoch seconds and `width` values of
+    `typecode`, in shared arrays allocated when the key is first seen, so
+    memory is fixed per key. Oldest entries are overwritten.
+    """
+
+    def __init__(self, capacity: int, width: int, typecode: str):
+        self.capacity = capacity
+        self.width = width
+        self.index: dict[tuple, int] = {}
+        self.times = array("d")
+        self.values = array(typecode)
+        # Next write position and count of entries of every key
+        self.heads = array("I")
+        self.sizes = array("I")
+
+    @property
+    def arrays(self) -> tuple[array, ...]:
+        return self.times, self.values, self.heads, self.sizes
+
+    def slot(self, key: tuple) -> int:
+        slot = self.index.get(key)
+        if slot is None:
+            slot = self.index[key] = len(self.heads)
+            self.times.frombytes(bytes(self.times.itemsize * self.capacity))
+            self.values.frombytes(
+                bytes(self.values.itemsize * self.width * self.capacity)
+            )
+            self.heads.append(0)
+            self.sizes.append(0)
+        return slot
+
+    def append(self, key: tuple, at: float, values: tuple):
+        slot = self.slot(key)
+        head = self.heads[slot]
+        position = slot * self.capacity + head
+        self.times[position] = at
+        offset = position * self.width
+        for i, value in enumerate(values):
+            self.values[offset + i] = value
+        self.heads[slot] = (head + 1) % self.capacity
+        self.sizes[slot] = min(self.sizes[slot] + 1, self.capacity)
+
+    def positions(self, key: tuple) -> list[int]:
+        """Array positions of a key's entries, oldest first."""
+        slot = self.index.get(key)
+        if slot is None:
+            return []
+
+        base, size = slot * self.capacity, self.sizes[slot]
+        start = (self.heads[slot] - size) % self.capacity
+        return [base + (start + i) % self.capacity for i in range(size)]
+
+    def entry(self, position: int) -> tuple[float, tuple]:
+        offset = position * self.width
+        return (
+            self.times[position],
+            tuple(self.values[offset : offset + self.width]),
+        )
+
+    def range(self, key: tuple, since: float, until: float) -> list[tuple]:
+        """`(time, values)` entries of a key in `[since, until]`."""
+        return [
+            self.entry(position)
+            for position in self.positions(key)
+            if since <= self.times[position] <= until
+        ]
+
+    def last(self, key: tuple) -> tuple[float, tuple] | None:
+        slot = self.index.get(key)
+        if slot is None or not self.sizes[slot]:
+            return None
+        return self.entry(
+            slot * self.capacity + (self.heads[slot] - 1) % self.capacity
+        )
+
+
+def downsample(
+    entries: list[tuple], since: float, until: float, step: float
+) -> list[tuple[float, tuple]]:
+    """Mean values of the entries per `step` seconds bucket of `[since,
+    until]`. Buckets without entries repeat the previous bucket."""
+    buckets = math.ceil((until - since) / step)
+    sums: list[list[float] | None] = [None] * buckets
+    samples = [0] * buckets
+    for at, values in entries:
+        bucket = min(int((at - since) / step), buckets - 1)
+        if sums[bucket] is None:
+            sums[bucket] = [0.0] * len(values)
+        samples[bucket] += 1
+        for i, value in enumerate(values):
+            sums[bucket][i] += value
+
+    series: list[tuple[float, tuple]] = []
+    previous: tuple | None = None
+    for bucket in range(buckets):
+        if samples[bucket]:
+            previous = tuple(
+                round(total / samples[bucket], 1) for total in sums[bucket]
+            )
+        if previous is not None:
+            series.append((since + bucket * step, previous))
+    return series
+
+
+class OccupancyHistory:
+    """In-memory Occupancy History of the Collector
+
+    Keeps the last `transitions` state changes of every sensor (9 bytes
+    each) and the last `samples` counts of every floor (16 bytes each). A
+    floor is sampled on every scan its counts changed, and at least every
+    `sample_interval` seconds.
+
+    Queries are served on the local metrics endpoint:
+
+    + `/history/slot?building=&floor=&sensor=&since=&until=`: Last change
+    and transitions of a slot.
+    + `/history/floor?building=&floor=&since=&until=&step=`: Floor counts
+    downsampled to `step` seconds.
+
+    `since` and `until` are epoch seconds, the last hour by default.
+    """
+
+    fields: tuple[str, ...] = ("free", "occupied", "disconnected", "unknown")
+    magic: bytes = b"MCIHIST1"
+
+    def __init__(
+        self,
+        transitions: int = config["history"]["transitions"],
+        samples: int = config["history"]["samples"],
+        sample_interval: float = config["history"]["sample_interval"],
+    ):
+        self.transitions = RingBuffers(transitions, 1, "b")
+        self.counts = RingBuffers(samples, len(self.fields), "H")
+        self.sample_interval = sample_interval
+        # Last sample of every floor: (time, counts)
+        self.sampled: dict[tuple, tuple[float, tuple[int, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def transition(
+        self, building: str, floor: int, sensor_id: str, state: SensorState
+    ):
+        key = (building, floor, sensor_id)
+        with self._lock:
+            # E.g. the first reading after a snapshot is restored
+            last = self.transitions.last(key)
+            if last and last[1][0] == state:
+                return
+            self.transitions.append(key, time.time(), (int(state),))
+
+    def sample(self, building: str, floor: int, totals: dict[str, int]):
+        now = time.time()
+        key = (building, floor)
+        counts = tuple(totals[field] for field in self.fields)
+        last = self.sampled.get(key)
+        if last and last[1] == counts and now - last[0] < self.sample_interval:
+            return
+
+        with self._lock:
+            self.counts.append(key, now, counts)
+        self.sampled[key] = (now, counts)
+
+    def slot(
+        self,
+        building: str,
+        floor: int,
+        sensor_id: str,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> dict:
+        since, until = time_range(since, until)
+        key = (building, floor, sensor_id)
+        with self._lock:
+            last = self.transitions.last(key)
+            transitions = self.transitions.range(key, since, until)
+        return {
+            "building": building,
+            "floor": floor,
+            "sensor_id": sensor_id,
+            "last_change": last[0] if last else None,
+            "state": last[1][0] if last else None,
+            "transitions": [[at, values[0]] for at, values in transitions],
+        }
+
+    def floor(
+        self,
+        building: str,
+        floor: int,
+        since: float | None = None,
+        until: float | None = None,
+        step: float = 60,
+    ) -> dict:
+        """Raises:
+        ValueError: `step` is not positive or makes over 10000 buckets.
+        """
+        since, until = time_range(since, until)
+        if step <= 0 or until <= since or (until - since) / step > 10_000:
+            raise ValueError("Invalid time range or step.")
+
+        with self._lock:
+            entries = self.counts.range((building, floor), since, until)
+        return {
+            "building": building,
+            "floor": floor,
+            "step": step,
+            "series": [
+                {"time": at, **dict(zip(self.fields, counts))}
+                for at, counts in downsample(entries, since, until, step)
+            ],
+        }
+
+    def save(self, path: str):
+        """Snapshots the history: a JSON header of the keys, then the raw
+        arrays. Written to a temporary file and renamed, so a crash never
+        leaves a partial snapshot."""
+        with self._lock:
+            arrays = self.transitions.arrays + self.counts.arrays
+            header = json.dumps(
+                {
+                    "transitions": self.transitions.capacity,
+                    "samples": self.counts.capacity,
+                    "sensors": list(self.transitions.index),
+                    "floors": list(self.counts.index),
+                    "arrays": [len(values) for values in arrays],
+                }
+            ).encode("utf-8")
+            with open(f"{path}.tmp", "wb") as snapshot:
+                snapshot.write(self.magic + struct.pack("<I", len(header)))
+                snapshot.write(header)
+                for values in arrays:
+                    values.tofile(snapshot)
+        os.replace(f"{path}.tmp", path)
+
+    def load(self, path: str) -> bool:
+        """Restores a snapshot, returns `False` when it is not a snapshot of the
+        same capacities."""
+        with open(path, "rb") as snapshot:
+            if snapshot.read(len(self.magic)) != self.magic:
+                return False
+            (length,) = struct.unpack("<I", snapshot.read(4))
+            header = json.loads(snapshot.read(length))
+            if (
+                header["transitions"] != self.transitions.capacity
+                or header["samples"] != self.counts.capacity
+            ):
+                return False
+
+            transitions = RingBuffers(self.transitions.capacity, 1, "b")
+            counts = RingBuffers(self.counts.capacity, len(self.fields), "H")
+            for values, count in zip(
+                transitions.arrays + counts.arrays, header["arrays"]
+            ):
+                values.fromfile(snapshot, count)
+
+        transitions.index = {
+            tuple(key): slot for slot, key in enumerate(header["sensors"])
+        }
+        counts.index = {tuple(key): slot for slot, key in enumerate(header["floors"])}
+        with self._lock:
+            self.transitions, self.counts = transitions, counts
+        return True
+
+
+def time_range(since: float | None, until: float | None) -> tuple[float, float]:
+    until = time.time() if until is None else until
+    since = until - 3600 if since is None else since
+    return since, until
+
+
+def occupancy_history(
+    snapshot_path: str = config["history"]["snapshot_path"],
+) -> OccupancyHistory:
+    """History restored from `snapshot_path`, when it exists, with its
+    queries served on the metrics endpoint."""
+    history = OccupancyHistory()
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            if not history.load(snapshot_path):
+                log.warning(
+                    "Snapshot %s is not compatible, starting empty.",
+                    snapshot_path,
+                    code="HISTORY",
+                )
+        except (OSError, ValueError, KeyError, EOFError, struct.error) as e:
+            log.warning(
+                "Snapshot %s is not readable. %s", snapshot_path, e, code="HISTORY"
+            )
+
+    metrics.routes["/history/slot"] = lambda building, floor, sensor, **times: (
+        history.slot(building, int(floor), sensor, **query_range(**times))
+    )
+    metrics.routes["/history/floor"] = lambda building, floor, step=60, **times: (
+        history.floor(
+            building, int(floor), step=float(step), **query_range(**times)
+        )
+    )
+    return history
+
+
+def save_history(history: OccupancyHistory | None, snapshot_path: str):
+    if history is None or not snapshot_path:
+        return
+
+    try:
+        history.save(snapshot_path)
+    except OSError as e:
+        log.error("Snapshot is not saved. %s", e, code="HISTORY")
+
+
+def query_range(since: str | None = None, until: str | None = None) -> dict:
+    return {
+        "since": None if since is None else float(since),
+        "until": None if until is None else float(until),
+    }
@@ -0,0 +1,151 @@
+import threading, time
+
+import redis
+
+from config import config
+from data.models import FloorStates, SensorState
+from logger import get_logger
+from supervisor import Supervisor
+import metrics
+
+
+log = get_logger(__name__)
+
+
+class LiveSlotCache:
+    """Redis Live Slot State Cache
+
+    Keeps the current state of every slot in Redis, so apps and signage read
+    the occupancy in O(1) without consuming the queue:
+
+    + `{prefix}:{building}:{floor}:slots`: Hash of `sensor_id` to its
+    `SensorState` (`0` free, `1` occupied, `2` disconnected).
+    + `{prefix}:{building}:{floor}:read_at`: Hash of `sensor_id` to epoch
+    seconds of its last read.
+    + `{prefix}:{building}:{floor}:totals`: Hash of the floor's `total`,
+    `unknown`, `free`, `occupied` and `disconnected` counts.
+    + `{prefix}:{building}:free`: Hash of `floor` to its free count.
+
+    Updates are coalesced per floor and written by a background thread in a
+    single `MULTI`/`EXEC` pipeline, one round trip per batch, when `flush` is
+    requested at the end of a scan or every `flush_interval` seconds. Readers
+    never see a floor's slots and counts out of step.
+
+    Batches failed while Redis is unreachable are merged back under newer
+    updates and retried with the `supervisor` backoff.
+    """
+
+    def __init__(
+        self,
+        url: str = config["db"]["redis"]["url"],
+        prefix: str = config["db"]["redis"]["prefix"],
+        flush_interval: float = config["db"]["redis"]["flush_interval"],
+        client=None,
+    ):
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.client = client or redis.Redis.from_url(
+            url,
+            socket_timeout=config["db"]["redis"]["socket_timeout"],
+            socket_connect_timeout=config["db"]["redis"]["socket_timeout"],
+        )
+        self.pending: dict[tuple[str, int], FloorStates] = {}
+        self.supervisor = Supervisor("Redis")
+        self.write_seconds = metrics.redis_write_seconds.labels()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing: bool = False
+        self._writer = threading.Thread(
+            target=self.run, name="redis", daemon=True
+        )
+        self._writer.start()
+
+    def floor(self, building: str, floor: int) -> FloorStates:
+        key = (building, floor)
+        states = self.pending.get(key)
+        if states is None:
+            states = self.pending[key] = FloorStates({}, {})
+        return states
+
+    def update(
+        self, building: str, floor: int, sensor_id: str, state: SensorState
+    ):
+        with self._lock:
+            states = self.floor(building, floor)
+            states.states[sensor_id] = int(state)
+            states.read_at[sensor_id] = round(time.time(), 3)
+
+    def totals(self, building: str, floor: int, totals: dict[str, int]):
+        with self._lock:
+            self.floor(building, floor).totals = totals
+
+    def flush(self):
+        """Requests the pending batch to be written."""
+        self._wake.set()
+
+    def close(self, timeout: float = 5):
+        self._closing = True
+        self._wake.set()
+        self._writer.join(timeout)
+
+    def run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                batch, self.pending = self.pending, {}
+
+            if batch:
+                try:
+                    self.write(batch)
+                    self.supervisor.connected()
+                except redis.RedisError as e:
+                    metrics.redis_errors.labels(type(e).__name__).inc()
+                    log.error("Live state write failed. %s", e, code="REDIS")
+                    self.merge(batch)
+                    if not self._closing:
+                        time.sleep(self.supervisor.failed())
+                        continue
+
+            if self._closing:
+                return
+
+    def write(self, batch: dict[tuple[str, int], FloorStates]):
+        started = time.perf_counter()
+        pipeline = self.client.pipeline(transaction=True)
+        for (building, floor), states in batch.items():
+            key = f"{self.prefix}:{building}:{floor}"
+            if states.states:
+                pipeline.hset(f"{key}:slots", mapping=states.states)
+                pipeline.hset(f"{key}:read_at", mapping=states.read_at)
+            if states.totals is not None:
+                pipeline.hset(f"{key}:totals", mapping=states.totals)
+                pipeline.hset(
+                    f"{self.prefix}:{building}:free",
+                    str(floor),
+                    states.totals["free"],
+                )
+        pipeline.execute()
+        self.write_seconds.observe(time.perf_counter() - started)
+
+    def merge(self, batch: dict[tuple[str, int], FloorStates]):
+        """Puts a failed batch back under the updates made since."""
+        with self._lock:
+            for key, failed in batch.items():
+                states = self.pending.get(key)
+                if states is None:
+                    self.pending[key] = failed
+                    continue
+
+                failed.states.update(states.states)
+                failed.read_at.update(states.read_at)
+                states.states, states.read_at = failed.states, failed.read_at
+                if states.totals is None:
+                    states.totals = failed.totals
+
+
+def live_slot_cache() -> LiveSlotCache | None:
+    """Cache of `config["db"]["redis"]`, `None` when it's disabled."""
+    if not config["db"]["redis"]["url"]:
+        return None
+    return LiveSlotCache()
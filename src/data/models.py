@@ -1,5 +1,7 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from dataclasses import dataclass
+from typing import Callable
+import time
 
 
 class Log(Enum):
@@ -8,12 +10,100 @@ class Log(Enum):
     critical = "critical"
 
 
+class SensorState(IntEnum):
+    free = 0
+    occupied = 1
+    disconnected = 2
+
+
 @dataclass
 class AMQPLoggingMessage:
     level: str
     content: int
 
 
+@dataclass
+class GatewayConfig:
+    building: str
+    ip: str
+    port: int
+
+
+@dataclass
+class GatewayTopology:
+    floor: int | None
+    sensors: tuple[str, ...]
+
+
+@dataclass(slots=True)
+class SpoolRecord:
+    queue_name: str
+    routing_key: str
+    body: bytes
+    segment: int
+    # End offset of the record in its segment
+    offset: int
+
+
+@dataclass(slots=True)
+class OutboxMessage:
+    queue_name: str
+    routing_key: str
+    body: bytes
+    attempts: int = 0
+    spool_record: SpoolRecord | None = None
+    # `time.monotonic()` of a traced reading's request, when it's queued
+    # and when it's last published, see `ReadingTrace`
+    traced_at: float | None = None
+    queued_at: float = 0.0
+    published_at: float = 0.0
+
+
+@dataclass
+class ScanReport:
+    floor: int | None
+    sensors: int
+    responses: int
+    timeouts: int
+    duration: float
+    # Seconds requests waited for an answer since the gateway last answered
+    # any request, idle time between polls excluded
+    silent_for: float = 0.0
+
+
+@dataclass(slots=True)
+class PollSlot:
+    sensor_id: str
+    interval: float
+    due_at: float
+    # Exponentially decayed transitions per second
+    rate: float = 0.0
+    polled_at: float | None = None
+    state: SensorState | None = None
+    # Consecutive polls without a decoded answer
+    misses: int = 0
+
+
+@dataclass(slots=True)
+class ConnectionStats:
+    connects: int = 0
+    failures: int = 0
+    # Seconds from losing the connection to reconnecting, of last outage
+    reconnect_time: float = 0.0
+    # Total seconds the connection was down, and since when it's down
+    downtime: float = 0.0
+    down_since: float | None = None
+
+
+@dataclass(slots=True)
+class FloorStates:
+    # Pending live state of the floor's slots by sensor_id: `SensorState`
+    # and epoch seconds of the last read
+    states: dict[str, int]
+    read_at: dict[str, float]
+    totals: dict[str, int] | None = None
+
+
 @dataclass
 class SensorsLogging:
     sensor_id: str
@@ -21,6 +111,63 @@ class SensorsLogging:
     message: AMQPLoggingMessage
 
 
+@dataclass(slots=True)
+class ReadingTrace:
+    """`time.monotonic()` of a sensor reading's stages: request sent on the
+    bus, response received, event handled (envelope build started) and
+    envelope built."""
+
+    sent: float
+    received: float
+    handled: float = 0.0
+    enveloped: float = 0.0
+
+    def fields(self) -> dict:
+        """Optional `trace` fields of the event, wall-clock epoch seconds of
+        the stages before the envelope build and their monotonic seconds.
+        Later stages are only observed by `reading_stage_seconds`."""
+        offset = time.time() - time.monotonic()
+        return {
+            "sent_at": round(self.sent + offset, 6),
+            "received_at": round(self.received + offset, 6),
+            "handled_at": round(self.handled + offset, 6),
+            "monotonic": [self.sent, self.received, self.handled],
+        }
+
+
+@dataclass
+class RFIDLogging:
+    tag: str
+    registered: bool
+    # Registered tag's document of `RFID` collection
+    card: dict | None
+    message: AMQPLoggingMessage
+
+
+@dataclass(slots=True)
+class BarrierCommand:
+    id: str | None
+    barrier: str
+    # `open` or `close`
+    command: str
+    # `time.monotonic()` when it's consumed from the broker
+    received_at: float
+    # Acknowledges the broker delivery
+    ack: Callable[[], None] | None = None
+
+
+@dataclass
+class BarrierLogging:
+    barrier: str
+    command: str
+    command_id: str | None
+    # `executed`, `timeout`, `rejected` or `expired`
+    status: str
+    # Seconds from consuming the command to the controller's acknowledgement
+    latency: float | None
+    message: AMQPLoggingMessage
+
+
 error_code: dict[str, dict[str, int]] = {
     "connected": {
         "rabbit": 1101,
@@ -33,13 +180,18 @@ error_code: dict[str, dict[str, int]] = {
     "sections": {
         "success": {
             "globalStatus": 1301,
+            "tagRead": 1302,
+            "barrierCommand": 1303,
         },
         "warning": {
             "sensorsIsDisconnected": 2300,
+            "unregisteredTag": 2301,
+            "barrierCommandRejected": 2302,
         },
         "critical": {
             "socketTimeout": 4300,
             "floorNotFound": 4301,
+            "barrierTimeout": 4302,
         },
     },
 }
@@ -1,127 +1,633 @@
-import json, time
+from collections import deque
+import json, threading, time
+from typing import Callable
 
 import pika
 from pika.exceptions import (
     AMQPChannelError,
-    AMQPConnectionError,
     AuthenticationError,
-    ChannelWrongStateError,
     StreamLostError,
 )
-import phpserialize3 as phpSerializer
-import uuid_utils as uuid
-
 from config import config
+from data.envelope import LaravelEnvelope
+from data.models import OutboxMessage
+from data.spool import Spool
+from logger import get_logger
+from supervisor import Supervisor
+import metrics
+
+
+log = get_logger(__name__)
+
+
+class BrokerNotConnected(Exception):
+    pass
+
+
+class Outbox:
+    """Bounded Outbox of Outgoing Messages
+
+    Holds messages waiting to be published (`pending`) and published
+    messages waiting for the broker's confirmation (`unconfirmed`, by
+    delivery tag). Both are counted against `max_size`, and when it's full
+    the `overflow` policy decides:
+
+    + `drop_oldest`: Oldest pending message is dropped.
+    + `drop_newest`: New message is dropped.
+    + `block`: Producer waits until messages are confirmed.
+
+    Messages replayed from the spool are never dropped, their records are
+    only acknowledged once the broker confirms them. They're queued by
+    `put_replayed` out of the policy, bounded by `RabbitMQ.replay` instead.
+
+    Nacked messages and messages still unconfirmed when the channel closes
+    go back to the head of `pending`, so they are retried in order.
+    """
+
+    overflow_policies: tuple[str, ...] = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, max_size: int, overflow: str):
+        if overflow not in self.overflow_policies:
+            raise ValueError(f"Unknown outbox overflow policy: {overflow}")
+
+        self.max_size = max_size
+        self.overflow = overflow
+        self.pending: deque[OutboxMessage] = deque()
+        self.unconfirmed: dict[int, OutboxMessage] = {}
+        self.dropped: int = 0
+        self.retried: int = 0
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.pending) + len(self.unconfirmed)
+
+    def put(self, message: OutboxMessage) -> bool:
+        """Queues a message and returns `False` if it's dropped."""
+        with self._condition:
+            while len(self) >= self.max_size:
+                if self.overflow == "block":
+                    self._condition.wait()
+                    continue
+
+                self.dropped += 1
+                if self.overflow == "drop_newest" or not self.drop_oldest():
+                    return False
+
+            self.pending.append(message)
+            return True
+
+    def put_replayed(self, message: OutboxMessage):
+        """Queues a spooled message, runs in the I/O thread so it never
+        waits."""
+        with self._condition:
+            self.pending.append(message)
+
+    def drop_oldest(self) -> bool:
+        """Drops the oldest pending message that is not replayed from the
+        spool, returns `False` when there's none."""
+        for index, message in enumerate(self.pending):
+            if message.spool_record is None:
+                del self.pending[index]
+                return True
+        return False
+
+    def take(self, count: int, is_ready) -> list[OutboxMessage]:
+        """Pops up to `count` pending messages in order, stopping at the
+        first message that `is_ready(message)` rejects."""
+        messages: list[OutboxMessage] = []
+        with self._condition:
+            while self.pending and len(messages) < count:
+                if not is_ready(self.pending[0]):
+                    break
+                messages.append(self.pending.popleft())
+        return messages
+
+    def sent(self, delivery_tag: int, message: OutboxMessage):
+        with self._condition:
+            self.unconfirmed[delivery_tag] = message
+
+    def confirm(
+        self, delivery_tag: int, multiple: bool, ack: bool
+    ) -> list[OutboxMessage]:
+        """Settles confirmed messages; nacked ones are queued for retry.
+
+        Return: Settled messages.
+        """
+        with self._condition:
+            if multiple:
+                tags: list[int] = []
+                for tag in self.unconfirmed:
+                    if tag > delivery_tag:
+                        break
+                    tags.append(tag)
+            else:
+                tags = [delivery_tag] if delivery_tag in self.unconfirmed else []
+
+            messages = [self.unconfirmed.pop(tag) for tag in tags]
+            if not ack:
+                self._retry(messages)
+            self._condition.notify_all()
+        return messages
+
+    def requeue_unconfirmed(self):
+        """Queues every unconfirmed message for retry, e.g. after the channel
+        is closed and its delivery tags are not valid anymore."""
+        with self._condition:
+            self._retry(list(self.unconfirmed.values()))
+            self.unconfirmed.clear()
+
+    def wait_empty(self, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self) == 0, timeout)
+
+    def _retry(self, messages: list[OutboxMessage]):
+        for message in reversed(messages):
+            message.attempts += 1
+            self.pending.appendleft(message)
+        self.retried += len(messages)
 
 
 class RabbitMQ:
-    def __init__(self):
+    """Asynchronous RabbitMQ Publisher
+
+    The connection lives in its own I/O thread (`pika.SelectConnection`), so
+    `produce` only queues messages into the `outbox` and never waits for the
+    broker. The I/O thread publishes them in batches, when `batch_size`
+    messages are pending or every `flush_interval` seconds, and tracks
+    publisher confirms to guarantee at-least-once delivery.
+
+    Messages produced while the broker is unreachable go to the disk `spool`,
+    and are replayed in order beside the live traffic once it's back. Lost
+    connections are reopened with the `supervisor` backoff.
+
+    Queues registered by `consume` are consumed on the same channel, and
+    consumed again on every new channel.
+    """
+
+    def __init__(
+        self, spool_directory: str = config["mq"]["spool"]["directory"]
+    ):
+        """Args:
+        spool_directory (str): Spool of this process, empty to disable it.
+        Directories can't be shared by processes, see `Spool`.
+        """
         self.user = config["mq"]["user"]
         self.password = config["mq"]["password"]
         self.host = config["mq"]["host"]
         self.port = config["mq"]["port"]
+        self.exchange = config["mq"]["exchange"]
+        self.exchange_type = config["mq"]["exchange_type"]
+        self.exchange_passive = config["mq"]["exchange_passive"]
+        self.exchange_durable = config["mq"]["exchange_durable"]
+        self.batch_size = config["mq"]["outbox"]["batch_size"]
+        self.flush_interval = config["mq"]["outbox"]["flush_interval"]
+        self.log_payloads = config["logging"]["payloads"]
+        self.outbox = Outbox(
+            config["mq"]["outbox"]["max_size"],
+            config["mq"]["outbox"]["overflow"],
+        )
+        self.spool = (
+            Spool(
+                spool_directory,
+                config["mq"]["spool"]["segment_size"],
+                config["mq"]["spool"]["max_bytes"],
+            )
+            if spool_directory
+            else None
+        )
+        self.envelopes: dict[str, LaravelEnvelope] = {}
         self.connection = None
         self.channel = None
+        # Declared `(queue_name, routing_key)` bindings of current channel
+        self.bindings: set[tuple[str, str]] = set()
+        self.declaring: set[tuple[str, str]] = set()
+        self.delivery_tag: int = 0
+        self.ready = threading.Event()
+        self.closing: bool = False
+        self.flush_requested: bool = False
+        self.io_thread: threading.Thread | None = None
+        # `(queue_name, routing_key, callback, prefetch)` of `consume`
+        self.consumers: list[tuple] = []
+        # `on_cancel` callbacks of `consume`
+        self.cancel_callbacks: list[Callable[[], None]] = []
+        self.supervisor = Supervisor("RabbitMQ")
+        # Interrupts the reconnect backoff on `close`
+        self.wake = threading.Event()
+
+        self.produce_seconds = metrics.mq_produce_seconds.labels()
+        self.queued = metrics.mq_messages.labels("queued")
+        self.dropped = metrics.mq_messages.labels("dropped")
+        self.spooled = metrics.mq_messages.labels("spooled")
+        self.acked = metrics.mq_confirms.labels("ack")
+        self.nacked = metrics.mq_confirms.labels("nack")
+        self.outbox_seconds = metrics.reading_stage_seconds.labels("outbox")
+        self.broker_seconds = metrics.reading_stage_seconds.labels("broker")
+        self.total_seconds = metrics.reading_stage_seconds.labels("total")
+        metrics.mq_backlog.labels("pending").set_function(
+            lambda: len(self.outbox.pending)
+        )
+        metrics.mq_backlog.labels("unconfirmed").set_function(
+            lambda: len(self.outbox.unconfirmed)
+        )
+        metrics.mq_downtime.labels().set_function(
+            lambda: self.supervisor.stats.downtime
+        )
         self.connect()
 
-    def connect(self):
-        """Open the RabbitMQ Connection."""
-        try:
-            credentials = pika.PlainCredentials(self.user, self.password)
-            parameters = pika.ConnectionParameters(
-                host=self.host, port=self.port, credentials=credentials
+    def connect(self, timeout: float = 0):
+        """Open the RabbitMQ Connection.
+
+        Starts the I/O thread and waits up to `timeout` seconds for the
+        channel to be ready. Messages produced while it's connecting are
+        kept in the outbox, and published once it's ready.
+        """
+        if self.io_thread and self.io_thread.is_alive():
+            return
+
+        self.io_thread = threading.Thread(
+            target=self.run_io_loop, name="rabbitmq", daemon=True
+        )
+        self.io_thread.start()
+        if timeout:
+            self.ready.wait(timeout)
+
+    def run_io_loop(self):
+        credentials = pika.PlainCredentials(self.user, self.password)
+        parameters = pika.ConnectionParameters(
+            host=self.host,
+            port=self.port,
+            credentials=credentials,
+            socket_timeout=config["mq"]["connect_timeout"],
+        )
+
+        while not self.closing:
+            try:
+                self.connection = pika.SelectConnection(
+                    parameters,
+                    on_open_callback=self.on_connection_open,
+                    on_open_error_callback=self.on_connection_error,
+                    on_close_callback=self.on_connection_closed,
+                )
+                self.connection.ioloop.start()
+            except Exception:
+                log.exception("Unknown error", code="BROKER")
+
+            if not self.closing:
+                self.wake.wait(self.supervisor.failed())
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_error(self, connection, error: Exception):
+        match error:
+            case AuthenticationError():
+                log.error(
+                    "Client auth failed. %s", error, code="AMQP_AUTHENTICATION"
+                )
+            case TimeoutError():
+                log.error("RabbitMQ connection timeout.", code="AMQP_TIMEOUT")
+            case _:
+                log.error(
+                    "Please check server configurations. Connection error",
+                    code="AMQP_CONNECTION_ERROR",
+                    fields={"error": str(error)},
+                )
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason: Exception):
+        self.on_channel_closed(self.channel, reason)
+        if isinstance(reason, StreamLostError):
+            log.warning("Transport indicated EOF.", code="AMQP_STREAM_LOST")
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        self.delivery_tag = 0
+        # Topology must be declared again on the new channel.
+        self.bindings = set()
+        self.declaring = set()
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.confirm_delivery(
+            ack_nack_callback=self.on_delivery_confirmation,
+            callback=lambda _: channel.exchange_declare(
+                exchange=self.exchange,
+                exchange_type=self.exchange_type,
+                passive=self.exchange_passive,
+                durable=self.exchange_durable,
+                callback=self.on_exchange_declared,
+            ),
+        )
+
+    def on_exchange_declared(self, _):
+        self.supervisor.connected()
+        self.ready.set()
+        for consumer in self.consumers:
+            self.start_consumer(*consumer)
+        self.schedule_flush()
+
+    def on_channel_closed(self, channel, reason: Exception):
+        if self.channel is None:
+            return
+
+        self.ready.clear()
+        self.channel = None
+        self.outbox.requeue_unconfirmed()
+        # Unacknowledged deliveries are redelivered on the next channel.
+        for on_cancel in self.cancel_callbacks:
+            on_cancel()
+        if isinstance(reason, AMQPChannelError):
+            log.error(
+                "Wrong Configurations. %s", reason, code="AMQP_CHANNEL_ERROR"
+            )
+        if self.connection and self.connection.is_open:
+            self.connection.close()
+
+    def on_delivery_confirmation(self, frame):
+        method = frame.method
+        ack = isinstance(method, pika.spec.Basic.Ack)
+        messages = self.outbox.confirm(method.delivery_tag, method.multiple, ack)
+        (self.acked if ack else self.nacked).inc(len(messages))
+        if ack:
+            self.observe_traced(messages)
+
+        if ack and self.spool:
+            for message in messages:
+                if message.spool_record:
+                    self.spool.ack(message.spool_record)
+            # Keep replaying as fast as the broker confirms.
+            if not self.spool.is_empty():
+                self.flush()
+
+    def observe_traced(self, messages: list[OutboxMessage]):
+        """Observes the outbox and broker stages of confirmed readings."""
+        now = time.monotonic()
+        for message in messages:
+            if message.traced_at is not None:
+                self.outbox_seconds.observe(message.published_at - message.queued_at)
+                self.broker_seconds.observe(now - message.published_at)
+                self.total_seconds.observe(now - message.traced_at)
+
+    def setup_topology(self, queue_name: str, routing_key: str):
+        """Declares the queue and its binding once per channel.
+
+        Args:
+            queue_name (str): Topic name
+            routing_key (str): Defines route of logs
+        """
+        binding = (queue_name, routing_key)
+        if binding in self.bindings or binding in self.declaring:
+            return
+
+        def on_bound(_):
+            self.declaring.discard(binding)
+            self.bindings.add(binding)
+            self.flush()
+
+        self.declaring.add(binding)
+        self.channel.queue_declare(
+            queue=queue_name,
+            durable=True,
+            callback=lambda _: self.channel.queue_bind(
+                exchange=self.exchange,
+                queue=queue_name,
+                routing_key=routing_key,
+                callback=on_bound,
+            ),
+        )
+
+    def consume(
+        self,
+        queue_name: str,
+        routing_key: str,
+        callback,
+        prefetch: int = 1,
+        on_cancel: Callable[[], None] | None = None,
+    ):
+        """Consumes a queue bound to the exchange with `routing_key`.
+
+        Args:
+            callback (body: bytes, ack: callable): Called in the I/O thread
+            for every message, it must not block. `ack()` acknowledges the
+            delivery from any thread, unacknowledged deliveries are
+            redelivered after a reconnect.
+            prefetch (int): Unacknowledged deliveries of the consumer.
+            on_cancel (callable): Called in the I/O thread when the channel
+            is closed, unacknowledged deliveries held by the consumer must be
+            dropped, they'll be redelivered.
+        """
+        consumer = (queue_name, routing_key, callback, prefetch)
+        self.consumers.append(consumer)
+        if on_cancel:
+            self.cancel_callbacks.append(on_cancel)
+        if self.ready.is_set():
+            self.connection.ioloop.add_callback_threadsafe(
+                lambda: self.start_consumer(*consumer)
+            )
+
+    def start_consumer(
+        self, queue_name: str, routing_key: str, callback, prefetch: int
+    ):
+        """Declares and consumes a queue on current channel, runs in the I/O
+        thread."""
+        channel = self.channel
+        if channel is None:
+            return
+
+        def on_message(_, method, properties, body: bytes):
+            callback(body, lambda: self.ack(channel, method.delivery_tag))
+
+        channel.basic_qos(
+            prefetch_count=prefetch,
+            callback=lambda _: channel.queue_declare(
+                queue=queue_name,
+                durable=True,
+                callback=lambda _: channel.queue_bind(
+                    exchange=self.exchange,
+                    queue=queue_name,
+                    routing_key=routing_key,
+                    callback=lambda _: channel.basic_consume(
+                        queue_name, on_message
+                    ),
+                ),
+            ),
+        )
+
+    def ack(self, channel, delivery_tag: int):
+        """Acknowledges a delivery of `channel` from any thread."""
+
+        def basic_ack():
+            # Delivery tags are not valid on a new channel
+            if channel is self.channel and channel.is_open:
+                channel.basic_ack(delivery_tag)
+
+        if channel is self.channel and self.connection:
+            self.connection.ioloop.add_callback_threadsafe(basic_ack)
+
+    def is_bound(self, message: OutboxMessage) -> bool:
+        if (message.queue_name, message.routing_key) in self.bindings:
+            return True
+        self.setup_topology(message.queue_name, message.routing_key)
+        return False
+
+    def schedule_flush(self):
+        """Periodic flush of the outbox, runs in the I/O thread."""
+        self.flush()
+        if self.channel:
+            self.connection.ioloop.call_later(
+                self.flush_interval, self.schedule_flush
             )
-            self.connection = pika.BlockingConnection(parameters)
-            self.channel = self.connection.channel()
-        except AuthenticationError as auth_error:
-            print(f"[AMQP_AUTHENTICATION]: Client auth failed. {auth_error}")
-        except AMQPConnectionError:
-            print(
-                "[AMQP_CONNECTION_ERROR]: Please check server configurations. Connection error"
+
+    def flush(self):
+        """Publishes pending messages of the outbox, runs in the I/O thread."""
+        self.flush_requested = False
+        while self.channel and self.channel.is_open:
+            self.replay()
+            messages = self.outbox.take(self.batch_size, self.is_bound)
+            if not messages:
+                return
+
+            now = time.monotonic()
+            for message in messages:
+                message.published_at = now
+                self.delivery_tag += 1
+                self.channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=message.routing_key,
+                    body=message.body,
+                    properties=pika.BasicProperties(delivery_mode=2),
+                )
+                self.outbox.sent(self.delivery_tag, message)
+
+    def replay(self):
+        """Moves spooled messages into the outbox, keeping half of it for
+        live traffic."""
+        if not self.spool:
+            return
+
+        room = self.outbox.max_size // 2 - len(self.outbox)
+        for record in self.spool.read(min(room, self.batch_size)):
+            self.outbox.put_replayed(
+                OutboxMessage(
+                    record.queue_name,
+                    record.routing_key,
+                    record.body,
+                    spool_record=record,
+                )
             )
-        except AMQPChannelError:
-            print("[AMQP_CHANNEL_ERROR]: Wrong Configurations. Fix RabbitMQ Channel.")
-        except TimeoutError:
-            print("[AMQP_TIMEOUT]: RabbitMQ connection timeout.")
-        except StreamLostError:
-            time.sleep(3)
-            self.connect()
-            print("[AMQP_STREAM_LOST]: Transport indicated EOF.")
-        except Exception as e:
-            print(f"Unknown error\n{e}")
-
-    def close(self):
-        """Close the RabbitMQ."""
+
+    def close(self, timeout: float = 5):
+        """Close the RabbitMQ after the outbox is drained or `timeout`."""
+        if self.ready.is_set():
+            self.outbox.wait_empty(timeout)
+
+        self.closing = True
+        self.wake.set()
         if self.connection and not self.connection.is_closed:
-            self.connection.close()
+            self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        if self.io_thread:
+            self.io_thread.join(timeout)
+        if self.spool:
+            self.spool_pending()
+            self.spool.close()
+
+    def spool_pending(self):
+        """Keeps messages that were not published by `close` on disk."""
+        for message in self.outbox.take(len(self.outbox.pending), lambda _: True):
+            # Replayed messages are still in the spool
+            if message.spool_record is None:
+                self.spool.append(
+                    message.queue_name, message.routing_key, message.body
+                )
+                self.spooled.inc()
 
-    def produce(self, queue_name: str, routing_key: str, message: dict):
+    def produce(
+        self,
+        queue_name: str,
+        routing_key: str,
+        message: dict | bytes,
+        traced_at: float | None = None,
+    ):
         """Produce and Publish Data to Streamline.
 
+        Message is queued into the outbox and published by the I/O thread.
+
         Args:
             queue_name (str): Topic name
             routing_key (str): Defines route of logs
-            message (dict): main context
+            message (dict | bytes): main context, or its encoded JSON
+            traced_at (float): `time.monotonic()` of a traced reading's
+            request, its outbox and broker stages are observed on confirm.
 
         Raises:
-            Exception: Connection error.
+            BrokerNotConnected: Connection is lost, or it couldn't be
+            established.
         """
-        if not self.channel:
-            raise Exception("Connection is not established!")
+        if not self.ready.is_set() and self.supervisor.stats.down_since is not None:
+            raise BrokerNotConnected("Connection is not established!")
 
-        try:
-            self.channel.queue_declare(queue=queue_name, durable=True)
-            self.channel.queue_bind(
-                exchange="system-logs",
-                queue=queue_name,
-                routing_key=routing_key,
+        started = time.perf_counter()
+        body = self.encode(message)
+        dropped = self.outbox.dropped
+        outbox_message = OutboxMessage(queue_name, routing_key, body)
+        if traced_at is not None:
+            outbox_message.traced_at = traced_at
+            outbox_message.queued_at = time.monotonic()
+        if self.outbox.put(outbox_message):
+            self.queued.inc()
+        else:
+            log.warning("Outbox is full, message is dropped.", code="BROKER")
+        # New message or the oldest pending one
+        self.dropped.inc(self.outbox.dropped - dropped)
+        self.produce_seconds.observe(time.perf_counter() - started)
+        if self.log_payloads:
+            log.info(
+                "%s",
+                body.decode("utf-8"),
+                code="PAYLOAD",
+                fields={"routing_key": routing_key},
             )
-            self.channel.basic_publish(
-                exchange="system-logs",
-                routing_key=routing_key,
-                body=json.dumps(message, indent=2).encode("utf-8"),
-                properties=pika.BasicProperties(delivery_mode=2),
+
+        if (
+            len(self.outbox.pending) >= self.batch_size
+            and not self.flush_requested
+            and self.ready.is_set()
+        ):
+            self.flush_requested = True
+            self.connection.ioloop.add_callback_threadsafe(self.flush)
+
+    def spool_message(
+        self, queue_name: str, routing_key: str, message: dict | bytes
+    ):
+        """Keeps the message on disk until the broker is reachable again."""
+        if not self.spool:
+            self.dropped.inc()
+            log.warning(
+                "Connection is not established, message is dropped.",
+                code="BROKER",
             )
-            print(json.dumps(message, indent=2))
-        except ChannelWrongStateError as channel_error:
-            print(f"[BROKER]: {channel_error}")
-        except TypeError as channel_blocking_error:
-            print(f"[BROKER]: {channel_blocking_error}")
+            return
 
-    def laravel_based_messaging(self, namespace: str, data: dict):
+        self.spool.append(queue_name, routing_key, self.encode(message))
+        self.spooled.inc()
+
+    @staticmethod
+    def encode(message: dict | bytes) -> bytes:
+        """Compact JSON, serialized once for both publish and log."""
+        if isinstance(message, bytes):
+            return message
+        return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+    def laravel_based_messaging(self, namespace: str, data: dict) -> bytes:
         """Laravel-based Messaging AMQP Format
 
         Args:
             namespace (str): Laravel MQ directory namespace
             data (dict): Main data to stream
-        Return: Proper data streams that Laravel can support.
+        Return: Proper data streams that Laravel can support, encoded as
+        compact JSON from the namespace's precompiled `LaravelEnvelope`.
         """
-        stream: dict = {
-            "data": data,
-            "connection": "rabbitmq",
-            "queue": "logs",
-        }
-
-        command: str = phpSerializer.dumps(stream)
-
-        return {
-            "uuid": str(uuid.uuid4()),
-            "displayName": namespace,
-            "job": "Illuminate\\Queue\\CallQueuedHandler@call",
-            "maxTries": None,
-            "maxExceptions": None,
-            "failOnTimeout": False,
-            "backoff": None,
-            "timeout": None,
-            "retryUntil": None,
-            "data": {
-                "commandName": namespace,
-                "command": f'O:{len(namespace)}:"{namespace}":'
-                + str(len(stream))
-                + ":{s:"
-                + str(6 + len(namespace))
-                + f':"\u0000{namespace}\u0000data";'
-                + command[16:],
-            },
-            "id": str(uuid.uuid4()),
-        }
+        envelope = self.envelopes.get(namespace)
+        if envelope is None:
+            envelope = self.envelopes[namespace] = LaravelEnvelope(namespace)
+
+        return envelope.build(data)
@@ -0,0 +1,76 @@
+import base64
+
+from data.models import SensorState
+
+
+class FloorOccupancy:
+    """Live Occupancy of a Floor
+
+    Keeps free, occupied, disconnected and unknown counts of the floor's
+    slots, and a bitmap with 2 bits per slot in the floor's sensor order:
+
+    + `0`: unknown (not read yet)
+    + `1`: free
+    + `2`: occupied
+    + `3`: disconnected
+
+    Slot `i` is at bits `2 * (i % 4)` of byte `i // 4`.
+    """
+
+    def __init__(self, building: str):
+        self.building = building
+        self.floor: int | None = None
+        self.sensors: tuple[str, ...] = ()
+        self.index: dict[str, int] = {}
+        self.bitmap = bytearray()
+        self.counts: list[int] = [0, 0, 0, 0]
+        # Changed since the last snapshot
+        self.changed: bool = False
+
+    def layout(self, floor: int | None, sensors: tuple[str, ...]):
+        """Resets the bitmap when the floor or its slots changed."""
+        if floor == self.floor and sensors == self.sensors:
+            return
+
+        self.floor = floor
+        self.sensors = sensors
+        self.index = {sensor_id: i for i, sensor_id in enumerate(sensors)}
+        self.bitmap = bytearray((len(sensors) + 3) // 4)
+        self.counts = [len(sensors), 0, 0, 0]
+        self.changed = True
+
+    def update(self, sensor_id: str, state: SensorState) -> bool:
+        """Records the sensor's state and returns whether it changed."""
+        index = self.index.get(sensor_id)
+        if index is None:
+            return False
+
+        byte, shift = index >> 2, (index & 3) << 1
+        previous = (self.bitmap[byte] >> shift) & 3
+        code = state + 1
+        if previous == code:
+            return False
+
+        self.bitmap[byte] = (self.bitmap[byte] & ~(3 << shift)) | (code << shift)
+        self.counts[previous] -= 1
+        self.counts[code] += 1
+        self.changed = True
+        return True
+
+    def totals(self) -> dict[str, int]:
+        return {
+            "total": len(self.sensors),
+            "unknown": self.counts[0],
+            "free": self.counts[1 + SensorState.free],
+            "occupied": self.counts[1 + SensorState.occupied],
+            "disconnected": self.counts[1 + SensorState.disconnected],
+        }
+
+    def snapshot(self) -> dict:
+        self.changed = False
+        return {
+            "building": self.building,
+            "floor": self.floor,
+            **self.totals(),
+            "bitmap": base64.b64encode(self.bitmap).decode("ascii"),
+        }
@@ -0,0 +1,184 @@
+from typing import Callable, Iterator
+import socket
+
+from config import config
+from data.models import SensorState
+
+
+class SensorProtocol:
+    """Gateway Sensor Read Protocol
+
+    Request frame of a sensor is its `sensor_id` followed by the read
+    command (`config["client_commands"]["sensor_read"]`), built once per
+    sensor.
+
+    Response is a `frame_length` bytes frame:
+
+    + Byte 0: Sensor address, `00` when sensor is disconnected.
+    + Byte 1: Function code, `03`.
+    + Byte 6: Slot status, `00` free and `01` occupied.
+    """
+
+    function_code: int = 0x03
+    status_index: int = 6
+
+    def __init__(
+        self,
+        command: str = config["client_commands"]["sensor_read"],
+        frame_length: int = config["client_commands"]["sensor_response_length"],
+    ):
+        self.command = command
+        self.frame_length = frame_length
+        self.requests: dict[str, bytes] = {}
+        self.addresses: dict[str, int | None] = {}
+
+    def request(self, sensor_id: str) -> bytes:
+        frame = self.requests.get(sensor_id)
+        if frame is None:
+            frame = self.requests[sensor_id] = (
+                f"{sensor_id}{self.command}".encode()
+            )
+        return frame
+
+    def address(self, sensor_id: str) -> int | None:
+        """Response address of a sensor, `None` if `sensor_id` is not hex."""
+        if sensor_id not in self.addresses:
+            try:
+                self.addresses[sensor_id] = int(sensor_id, 16) & 0xFF
+            except ValueError:
+                self.addresses[sensor_id] = None
+        return self.addresses[sensor_id]
+
+    def is_valid(self, frame: memoryview) -> bool:
+        return frame[0] == 0 or frame[1] == self.function_code
+
+    def decode(self, frame: memoryview) -> SensorState | None:
+        """Sensor state of a valid frame, `None` for unknown status."""
+        if frame[0] == 0:
+            return SensorState.disconnected
+
+        match frame[self.status_index]:
+            case 0x00:
+                return SensorState.free
+            case 0x01:
+                return SensorState.occupied
+            case _:
+                return None
+
+
+class BarrierProtocol:
+    """Barrier Controller Command Protocol
+
+    Request frame of a command is the `barrier` id followed by the command
+    code (`config["client_commands"]["barrier"]`). The controller
+    acknowledges a command by echoing its frame once the barrier is
+    actuated.
+    """
+
+    commands: tuple[str, ...] = ("open", "close", "read")
+
+    def __init__(self, codes: dict = config["client_commands"]["barrier"]):
+        self.codes = {command: codes.get(command) for command in self.commands}
+        self.requests: dict[tuple[str, str], bytes] = {}
+
+    def request(self, barrier: str, command: str) -> bytes:
+        """Request frame of a command.
+
+        Raises:
+            ValueError: Unknown command, or its code is not configured.
+        """
+        frame = self.requests.get((barrier, command))
+        if frame is None:
+            if not self.codes.get(command):
+                raise ValueError(f"Unknown barrier command: {command}")
+            frame = self.requests[(barrier, command)] = (
+                f"{barrier}{self.codes[command]}".encode()
+            )
+        return frame
+
+
+class FrameBuffer:
+    """Reusable Receive Buffer
+
+    Socket data is received straight into a preallocated buffer and split
+    into fixed-length frames, so short and coalesced TCP reads are
+    reassembled. Bytes that don't start a valid frame are skipped one by
+    one until the stream is aligned again.
+
+    Yielded frames are views on the buffer and are only valid until the
+    next receive.
+    """
+
+    def __init__(self, frame_length: int, capacity: int = 4096):
+        self.frame_length = frame_length
+        self.buffer = bytearray(max(capacity, frame_length))
+        self.view = memoryview(self.buffer)
+        self.start: int = 0
+        self.end: int = 0
+        self.skipped: int = 0
+
+    def writable(self) -> memoryview:
+        """Free part of the buffer, compacted when it's too small."""
+        if len(self.buffer) - self.end < self.frame_length:
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.buffer[self.start : self.end]
+            self.start, self.end = 0, remaining
+        return self.view[self.end :]
+
+    def written(self, count: int):
+        if not count:
+            raise ConnectionResetError("Gateway closed the connection.")
+        self.end += count
+
+    def recv_into(self, client: socket.socket):
+        self.written(client.recv_into(self.writable()))
+
+    def frames(
+        self, is_valid: Callable[[memoryview], bool]
+    ) -> Iterator[memoryview]:
+        while self.end - self.start >= self.frame_length:
+            frame = self.view[self.start : self.start + self.frame_length]
+            if not is_valid(frame):
+                self.start += 1
+                self.skipped += 1
+                continue
+
+            self.start += self.frame_length
+            yield frame
+
+        if self.start == self.end:
+            self.start = self.end = 0
+
+
+class DelimitedFrameBuffer(FrameBuffer):
+    """Reusable Receive Buffer of Delimited Frames
+
+    Same as `FrameBuffer` for streams of variable-length frames ending with
+    `delimiter`, such as RFID reader tag lines. Data without a delimiter in
+    `max_frame_length` bytes is skipped.
+    """
+
+    def __init__(
+        self, delimiter: bytes, max_frame_length: int, capacity: int = 4096
+    ):
+        super().__init__(max_frame_length + len(delimiter), capacity)
+        self.delimiter = delimiter
+
+    def frames(
+        self, is_valid: Callable[[memoryview], bool] = bool
+    ) -> Iterator[memoryview]:
+        while self.start < self.end:
+            index = self.buffer.find(self.delimiter, self.start, self.end)
+            if index == -1:
+                if self.end - self.start >= self.frame_length:
+                    self.skipped += self.end - self.start
+                    self.start = self.end
+                break
+
+            frame = self.view[self.start : index]
+            self.start = index + len(self.delimiter)
+            if is_valid(frame):
+                yield frame
+
+        if self.start == self.end:
+            self.start = self.end = 0
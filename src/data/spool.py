@@ -0,0 +1,274 @@
+import fcntl, os, struct, threading, time, zlib
+
+from data.models import SpoolRecord
+from logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class SpoolLocked(OSError):
+    pass
+
+
+class Spool:
+    """Append-only Disk Spool of Undelivered Messages
+
+    Messages that can't reach RabbitMQ are appended to segment files
+    (`<directory>/<sequence>.seg`) with sequential writes, and read back in
+    order when the broker returns.
+
+    Every record is `header` (queue name, routing key and body lengths, and
+    CRC32 of the payload) followed by the three fields as payload. A
+    truncated or corrupted record ends its segment.
+
+    Acknowledged records move the `cursor` file forward, and segments that
+    are completely read and acknowledged are deleted. When segments exceed
+    `max_bytes`, the oldest segment is dropped.
+
+    The directory is locked (`lock` file) while the spool is open, as it's
+    only consistent with one process using it.
+
+    Raises:
+        SpoolLocked: Directory is used by another process.
+    """
+
+    header = struct.Struct(">HHII")
+    cursor = struct.Struct(">QQ")
+
+    def __init__(self, directory: str, segment_size: int, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.lock = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock.close()
+            raise SpoolLocked(f"Spool {directory} is used by another process.")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.dropped_bytes: int = 0
+        self._lock = threading.Lock()
+
+        self.segments: list[int] = sorted(
+            int(name[:-4])
+            for name in os.listdir(directory)
+            if name.endswith(".seg")
+        )
+        self.sizes: dict[int, int] = {
+            sequence: os.path.getsize(self.path(sequence))
+            for sequence in self.segments
+        }
+
+        # Everything before `(acked_segment, acked_offset)` is acknowledged.
+        # Acknowledged and empty segments, e.g. heads of runs without any
+        # outage, are removed.
+        self.acked_segment, self.acked_offset = self.load_cursor()
+        for sequence in [
+            s
+            for s in self.segments
+            if s < self.acked_segment
+            or not self.sizes[s]
+            or (s == self.acked_segment and self.acked_offset >= self.sizes[s])
+        ]:
+            os.remove(self.path(sequence))
+            self.segments.remove(sequence)
+            del self.sizes[sequence]
+        if self.acked_segment not in self.sizes:
+            self.acked_segment = self.segments[0] if self.segments else 0
+            self.acked_offset = 0
+
+        # A crash may leave a partial record at the tail, so appends always
+        # start a new segment.
+        head = self.segments[-1] + 1 if self.segments else self.acked_segment
+        self.segments.append(head)
+        self.sizes[head] = 0
+        self.writer = open(self.path(head), "ab")
+
+        self.read_segment, self.read_offset = (
+            self.acked_segment,
+            self.acked_offset,
+        )
+        self.reader = None
+        # Replayed `end offset -> acknowledged` per segment, in read order
+        self.outstanding: dict[int, dict[int, bool]] = {}
+        # Cursor of the removed segments would be ahead of the new head
+        self.save_cursor()
+
+    def path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"{sequence:016d}.seg")
+
+    def is_empty(self) -> bool:
+        return (
+            self.read_segment == self.segments[-1]
+            and self.read_offset >= self.sizes[self.read_segment]
+        )
+
+    def append(self, queue_name: str, routing_key: str, body: bytes):
+        queue = queue_name.encode("utf-8")
+        route = routing_key.encode("utf-8")
+        payload = queue + route + body
+        record = (
+            self.header.pack(
+                len(queue), len(route), len(body), zlib.crc32(payload)
+            )
+            + payload
+        )
+
+        with self._lock:
+            head = self.segments[-1]
+            if self.sizes[head] and self.sizes[head] + len(record) > (
+                self.segment_size
+            ):
+                head = self.roll()
+
+            while (
+                sum(self.sizes.values()) + len(record) > self.max_bytes
+                and len(self.segments) > 1
+            ):
+                self.dropped_bytes += self.sizes[self.segments[0]]
+                log.warning(
+                    "Disk usage cap reached, oldest segment dropped.", code="SPOOL"
+                )
+                self.remove_segment(self.segments[0])
+
+            self.writer.write(record)
+            self.writer.flush()
+            self.sizes[head] += len(record)
+
+    def read(self, count: int) -> list[SpoolRecord]:
+        """Reads up to `count` records that are not replayed yet."""
+        records: list[SpoolRecord] = []
+        with self._lock:
+            while len(records) < count and not self.is_empty():
+                if self.read_offset >= self.sizes[self.read_segment]:
+                    self.next_read_segment()
+                    continue
+
+                record = self.read_record()
+                if record is None:
+                    log.error(
+                        "Corrupted record in %s.", self.read_segment, code="SPOOL"
+                    )
+                    self.read_offset = self.sizes[self.read_segment]
+                    continue
+
+                self.outstanding.setdefault(record.segment, {})[
+                    record.offset
+                ] = False
+                records.append(record)
+        return records
+
+    def ack(self, record: SpoolRecord):
+        """Acknowledges a replayed record and compacts acknowledged
+        segments."""
+        with self._lock:
+            offsets = self.outstanding.get(record.segment)
+            if offsets is None or record.offset not in offsets:
+                return
+            offsets[record.offset] = True
+            self.compact()
+
+    def close(self):
+        with self._lock:
+            self.writer.close()
+            if self.reader:
+                self.reader.close()
+            self.save_cursor()
+            # Releases the directory
+            self.lock.close()
+
+    def roll(self) -> int:
+        head = self.segments[-1] + 1
+        self.writer.close()
+        self.writer = open(self.path(head), "ab")
+        self.segments.append(head)
+        self.sizes[head] = 0
+        return head
+
+    def next_read_segment(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+        self.read_segment = self.segments[
+            self.segments.index(self.read_segment) + 1
+        ]
+        self.read_offset = 0
+
+    def read_record(self) -> SpoolRecord | None:
+        if self.reader is None:
+            self.reader = open(self.path(self.read_segment), "rb")
+        self.reader.seek(self.read_offset)
+
+        header = self.reader.read(self.header.size)
+        if len(header) < self.header.size:
+            return None
+        queue_length, route_length, body_length, crc = self.header.unpack(
+            header
+        )
+        payload = self.reader.read(queue_length + route_length + body_length)
+        if (
+            len(payload) < queue_length + route_length + body_length
+            or zlib.crc32(payload) != crc
+        ):
+            return None
+
+        self.read_offset += self.header.size + len(payload)
+        return SpoolRecord(
+            queue_name=payload[:queue_length].decode("utf-8"),
+            routing_key=payload[
+                queue_length : queue_length + route_length
+            ].decode("utf-8"),
+            body=payload[queue_length + route_length :],
+            segment=self.read_segment,
+            offset=self.read_offset,
+        )
+
+    def compact(self):
+        while self.segments:
+            sequence = self.segments[0]
+            offsets = self.outstanding.get(sequence, {})
+            for offset in list(offsets):
+                if not offsets[offset]:
+                    break
+                del offsets[offset]
+                if sequence == self.acked_segment:
+                    self.acked_offset = offset
+
+            # Segment is completely read and acknowledged.
+            if (
+                not offsets
+                and sequence != self.read_segment
+                and sequence != self.segments[-1]
+            ):
+                self.remove_segment(sequence)
+                self.save_cursor()
+                continue
+            break
+
+        if time.monotonic() - self.cursor_saved_at >= 1:
+            self.save_cursor()
+
+    def remove_segment(self, sequence: int):
+        if sequence == self.read_segment:
+            self.next_read_segment()
+        os.remove(self.path(sequence))
+        self.segments.remove(sequence)
+        self.sizes.pop(sequence, None)
+        self.outstanding.pop(sequence, None)
+        if sequence == self.acked_segment and self.segments:
+            self.acked_segment, self.acked_offset = self.segments[0], 0
+
+    def load_cursor(self) -> tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor"), "rb") as cursor:
+                return self.cursor.unpack(cursor.read(self.cursor.size))
+        except (OSError, struct.error):
+            return 0, 0
+
+    def save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(f"{path}.tmp", "wb") as cursor:
+            cursor.write(self.cursor.pack(self.acked_segment, self.acked_offset))
+        os.replace(f"{path}.tmp", path)
+        self.cursor_saved_at = time.monotonic()
@@ -0,0 +1,103 @@
+from array import array
+from collections import OrderedDict
+
+from data.models import SensorState
+
+
+class SensorStateTable:
+    """Last Emitted State of Every Sensor
+
+    Compact table, keyed by `sensor_id`, that decides whether a reading must
+    be published:
+
+    + Transitions (free/occupied/disconnected) are emitted immediately.
+    + Unchanged states are emitted again as a heartbeat every `heartbeat`
+    seconds, or never when `heartbeat` is `0`.
+
+    Everything else is suppressed and counted.
+    """
+
+    __slots__ = (
+        "heartbeat",
+        "index",
+        "states",
+        "emitted_at",
+        "emitted",
+        "suppressed",
+    )
+
+    unknown: int = -1
+
+    def __init__(self, heartbeat: float):
+        self.heartbeat = heartbeat
+        self.index: dict[str, int] = {}
+        self.states = array("b")
+        self.emitted_at = array("d")
+        self.emitted: int = 0
+        self.suppressed: int = 0
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def slot(self, sensor_id: str) -> int:
+        index = self.index.get(sensor_id)
+        if index is None:
+            index = self.index[sensor_id] = len(self.states)
+            self.states.append(self.unknown)
+            self.emitted_at.append(0.0)
+        return index
+
+    def get(self, sensor_id: str) -> SensorState | None:
+        index = self.index.get(sensor_id)
+        if index is None or self.states[index] == self.unknown:
+            return None
+        return SensorState(self.states[index])
+
+    def update(self, sensor_id: str, state: SensorState, now: float) -> bool:
+        """Records the sensor's state and returns whether it must be
+        emitted."""
+        index = self.slot(sensor_id)
+
+        if self.states[index] == state and (
+            not self.heartbeat or now - self.emitted_at[index] < self.heartbeat
+        ):
+            self.suppressed += 1
+            return False
+
+        self.states[index] = state
+        self.emitted_at[index] = now
+        self.emitted += 1
+        return True
+
+
+class TagDeduplicator:
+    """Drops repeated reads of the same RFID tag.
+
+    A reader keeps reporting a tag while it's in the field, so a tag is only
+    passed again after `window` seconds without reads of it.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        # Last read of every tag, least recently read first
+        self.last_read: OrderedDict[str, float] = OrderedDict()
+        self.duplicates: int = 0
+
+    def __len__(self) -> int:
+        return len(self.last_read)
+
+    def is_new(self, tag: str, now: float) -> bool:
+        last_read = self.last_read.pop(tag, None)
+        self.last_read[tag] = now
+        if last_read is not None and now - last_read < self.window:
+            self.duplicates += 1
+            return False
+        return True
+
+    def prune(self, now: float):
+        """Forgets tags not read for `window` seconds."""
+        while self.last_read:
+            tag, last_read = next(iter(self.last_read.items()))
+            if now - last_read < self.window:
+                break
+            del self.last_read[tag]
@@ -0,0 +1,143 @@
+"""Structured Logging of the Gateway Service
+
+Records are queued by the calling thread and formatted and written by a
+background `QueueListener`, so the polling loop never waits for stdout.
+Every record carries its application-side log `code` (see the `__main__`
+table, e.g. `SOCKET`) and optional `fields`:
+
+```python
+log = get_logger(__name__)
+log.warning("The Connection refused.", code="SOCKET", fields={"gateway": ip})
+```
+
+Repeated warnings and errors of the same code, message and gateway are
+emitted once per `rate_limit` seconds, with the count of suppressed ones.
+Messages use `%` arguments, so the message template identifies them.
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit, json, logging, queue, sys, time
+
+from config import config
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger accepting `code` and `fields` keyword arguments."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {
+            "code": kwargs.pop("code", None),
+            "fields": kwargs.pop("fields", None) or {},
+        }
+        return msg, kwargs
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(name), {})
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeats of a warning or error within `interval` seconds."""
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        # key: [last emitted at, suppressed since]
+        self.seen: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.suppressed = 0
+        if record.levelno < logging.WARNING or not self.interval:
+            return True
+
+        fields = getattr(record, "fields", None) or {}
+        key = (
+            record.name,
+            record.levelno,
+            getattr(record, "code", None),
+            record.msg,
+            fields.get("gateway"),
+        )
+        now = time.monotonic()
+        seen = self.seen.get(key)
+        if seen and now - seen[0] < self.interval:
+            seen[1] += 1
+            return False
+
+        record.suppressed = seen[1] if seen else 0
+        self.seen[key] = [now, 0]
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queues records without formatting them, and drops them instead of
+    blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatted by the listener's thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "code": getattr(record, "code", None),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        code = getattr(record, "code", None) or record.levelname
+        line = f"[{code}]: {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if getattr(record, "suppressed", 0):
+            line += f" ({record.suppressed} suppressed)"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(
+    level: str = config["logging"]["level"],
+    format: str = config["logging"]["format"],
+) -> QueueListener:
+    """Routes every log record through the background queue listener."""
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if format == "json" else TextFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(config["logging"]["queue_size"]))
+    handler.addFilter(RateLimitFilter(config["logging"]["rate_limit"]))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    for name, logger_level in config["logging"]["levels"].items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    # Flush queued records on exit
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,457 @@
+"""Metrics of the Gateway Service
+
+Counters, gauges and HDR-style histograms, kept in process and exposed in
+Prometheus text format on `http://<host>:<port>/metrics`.
+
+Hot paths resolve their labeled series once (e.g. per gateway section) and
+only do an addition or a bucket increment per event. Updates are not
+locked, series are updated from one thread each.
+"""
+
+from array import array
+from collections import Counter as Samples
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import json, math, signal, sys, threading, time
+from typing import Callable
+
+from config import config
+from logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class Counter:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value: float = 0.0
+        self.function = None
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set_function(self, function):
+        """Reads the counter from `function()` on collection instead, e.g. a
+        count kept by its owner."""
+        self.function = function
+
+    def samples(self, name: str, labels: str):
+        value = self.function() if self.function else self.value
+        yield f"{name}_total{labels} {value}"
+
+
+class Gauge:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value: float = 0.0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """Reads the gauge from `function()` on collection instead."""
+        self.function = function
+
+    def samples(self, name: str, labels: str):
+        value = self.function() if self.function else self.value
+        yield f"{name}{labels} {value}"
+
+
+class Histogram:
+    """HDR-style Histogram
+
+    Log-linear buckets: every power of two is split in `sub_buckets` equal
+    buckets, so the relative error is below `1 / sub_buckets` from about
+    1µs to 1h, in fixed memory and with an O(1) `observe`.
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    sub_buckets: int = 8
+    min_exponent: int = -19
+    max_exponent: int = 12
+
+    def __init__(self):
+        buckets = (self.max_exponent - self.min_exponent) * self.sub_buckets
+        self.counts = array("Q", bytes(8 * buckets))
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value <= 0:
+            self.counts[0] += 1
+            return
+
+        mantissa, exponent = math.frexp(value)
+        index = (exponent - self.min_exponent) * self.sub_buckets + int(
+            (mantissa - 0.5) * 2 * self.sub_buckets
+        )
+        self.counts[min(max(index, 0), len(self.counts) - 1)] += 1
+
+    @classmethod
+    def upper_bound(cls, index: int) -> float:
+        exponent, sub_bucket = divmod(index, cls.sub_buckets)
+        return math.ldexp(
+            0.5 + (sub_bucket + 1) / (2 * cls.sub_buckets),
+            exponent + cls.min_exponent,
+        )
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket of the `fraction` quantile."""
+        rank = math.ceil(fraction * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.upper_bound(index)
+        return 0.0
+
+    def samples(self, name: str, labels: str):
+        # Only non-empty buckets, `le` must be inserted into the labels.
+        prefix = f"{labels[:-1]}," if labels else "{"
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                cumulative += count
+                le = f"{self.upper_bound(index):.6g}"
+                yield f'{name}_bucket{prefix}le="{le}"}} {cumulative}'
+        yield f'{name}_bucket{prefix}le="+Inf"}} {self.count}'
+        yield f"{name}_sum{labels} {self.sum}"
+        yield f"{name}_count{labels} {self.count}"
+
+
+class Family:
+    """Metric with its series per label values."""
+
+    def __init__(self, kind: type, name: str, help: str, labelnames: tuple):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.series: dict[tuple, Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> Counter | Gauge | Histogram:
+        series = self.series.get(values)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(values, self.kind())
+        return series
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind.__name__.lower()}",
+        ]
+        for values, series in list(self.series.items()):
+            labels = ",".join(
+                f'{name}="{value}"'
+                for name, value in zip(self.labelnames, values)
+            )
+            lines.extend(
+                series.samples(self.name, f"{{{labels}}}" if labels else "")
+            )
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.families: list[Family] = []
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Family:
+        return self.register(Family(Counter, name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Family:
+        return self.register(Family(Gauge, name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = ()) -> Family:
+        return self.register(Family(Histogram, name, help, labelnames))
+
+    def register(self, family: Family) -> Family:
+        self.families.append(family)
+        return family
+
+    def render(self) -> bytes:
+        lines: list[str] = []
+        for family in self.families:
+            lines.extend(family.render())
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+
+registry = Registry()
+
+SECTION_LABELS = ("building", "gateway", "section")
+
+gateway_connects = registry.counter(
+    "gateway_connects", "Successful gateway socket connects.", SECTION_LABELS
+)
+gateway_errors = registry.counter(
+    "gateway_errors",
+    "Gateway socket errors by type.",
+    SECTION_LABELS + ("error",),
+)
+gateway_downtime = registry.gauge(
+    "gateway_downtime_seconds",
+    "Total seconds the gateway was down.",
+    SECTION_LABELS,
+)
+scan_seconds = registry.histogram(
+    "gateway_scan_seconds", "Duration of a sensors scan.", SECTION_LABELS
+)
+response_seconds = registry.histogram(
+    "gateway_response_seconds",
+    "Sensor read latency from request to response.",
+    SECTION_LABELS,
+)
+sensor_responses = registry.counter(
+    "gateway_sensor_responses", "Answered sensor reads.", SECTION_LABELS
+)
+sensor_timeouts = registry.counter(
+    "gateway_sensor_timeouts", "Unanswered sensor reads.", SECTION_LABELS
+)
+publish_seconds = registry.histogram(
+    "section_publish_seconds",
+    "Envelope build and produce time of an event.",
+    SECTION_LABELS,
+)
+command_seconds = registry.histogram(
+    "barrier_command_seconds",
+    "Barrier command latency from consume to actuation.",
+    SECTION_LABELS,
+)
+sensor_states = registry.counter(
+    "gateway_sensor_states",
+    "Sensor readings by state table result, `emitted` or `suppressed`.",
+    SECTION_LABELS + ("result",),
+)
+barrier_commands = registry.counter(
+    "barrier_commands", "Barrier commands by status.", SECTION_LABELS + ("status",)
+)
+# Stages: `bus` request to response, `handle` response to envelope build,
+# `envelope` the build, `produce` queueing into the outbox (or the spool),
+# `outbox` queued to published, `broker` published to confirmed, and `total`
+# request to confirmed.
+reading_stage_seconds = registry.histogram(
+    "reading_stage_seconds", "Published sensor reading latency by stage.", ("stage",)
+)
+mq_produce_seconds = registry.histogram(
+    "mq_produce_seconds", "Time to queue a message into the outbox."
+)
+mq_messages = registry.counter(
+    "mq_messages", "Produced messages by result.", ("result",)
+)
+mq_confirms = registry.counter(
+    "mq_confirms", "Publisher confirms by result.", ("result",)
+)
+mq_backlog = registry.gauge(
+    "mq_backlog_messages", "Messages of the outbox.", ("state",)
+)
+mq_downtime = registry.gauge(
+    "mq_downtime_seconds", "Total seconds the broker was down."
+)
+mongo_query_seconds = registry.histogram(
+    "mongo_query_seconds", "MongoDB query time.", ("collection", "operation")
+)
+mongo_errors = registry.counter(
+    "mongo_errors", "MongoDB query errors by type.", ("error",)
+)
+redis_write_seconds = registry.histogram(
+    "redis_write_seconds", "Live slot state batch write time."
+)
+redis_errors = registry.counter(
+    "redis_errors", "Redis write errors by type.", ("error",)
+)
+
+
+class SectionMetrics:
+    """Series of a gateway's application section."""
+
+    def __init__(self, building: str, gateway: str, section: str):
+        self.labels = (building, gateway, section)
+        self.connects = gateway_connects.labels(*self.labels)
+        self.downtime = gateway_downtime.labels(*self.labels)
+        self.scan_seconds = scan_seconds.labels(*self.labels)
+        self.response_seconds = response_seconds.labels(*self.labels)
+        self.responses = sensor_responses.labels(*self.labels)
+        self.timeouts = sensor_timeouts.labels(*self.labels)
+        self.publish_seconds = publish_seconds.labels(*self.labels)
+        self.command_seconds = command_seconds.labels(*self.labels)
+        self.bus_seconds = reading_stage_seconds.labels("bus")
+        self.handle_seconds = reading_stage_seconds.labels("handle")
+        self.envelope_seconds = reading_stage_seconds.labels("envelope")
+        self.produce_seconds = reading_stage_seconds.labels("produce")
+
+    def states(self, table):
+        """Exports the emitted and suppressed readings of a `SensorStateTable`."""
+        sensor_states.labels(*self.labels, "emitted").set_function(
+            lambda: table.emitted
+        )
+        sensor_states.labels(*self.labels, "suppressed").set_function(
+            lambda: table.suppressed
+        )
+
+    def error(self, error: Exception):
+        gateway_errors.labels(*self.labels, type(error).__name__).inc()
+
+    def command(self, status: str):
+        barrier_commands.labels(*self.labels, status).inc()
+
+
+# Set once the service's section is running
+ready = threading.Event()
+
+# JSON endpoints by path, called with the query parameters. `ValueError` and
+# `KeyError` are answered as bad requests.
+routes: dict[str, Callable[..., dict]] = {}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/ready":
+            self.send_response(200 if ready.is_set() else 503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if path in routes:
+            self.send_json(path, query)
+            return
+        if path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = registry.render()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, path: str, query: str):
+        parameters = {key: values[-1] for key, values in parse_qs(query).items()}
+        try:
+            body = json.dumps(routes[path](**parameters)).encode("utf-8")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(
+    host: str = config["metrics"]["host"], port: int = config["metrics"]["port"]
+) -> ThreadingHTTPServer | None:
+    """Serves `/metrics`, `/ready` and `routes` in a background thread, `port` `0`
+    disables it."""
+    if not port:
+        return None
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        log.warning(
+            "Endpoint is not available on %s:%s. %s", host, port, e, code="METRICS"
+        )
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics", daemon=True
+    ).start()
+    log.info("Serving on http://%s:%s/metrics", host, port, code="METRICS")
+    return server
+
+
+class Profiler:
+    """Sampling Profiler
+
+    Samples stacks of every thread each `interval` seconds while running,
+    and writes them as folded stacks (`thread;outer;...;inner count`, the
+    flame graph input) to `path` when stopped.
+    """
+
+    def __init__(
+        self,
+        interval: float = config["metrics"]["profile_interval"],
+        path: str = config["metrics"]["profile_path"],
+    ):
+        self.interval = interval
+        self.path = path
+        self.samples: Samples[str] = Samples()
+        self.running = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def toggle(self, *_):
+        if self.running.is_set():
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        self.samples.clear()
+        self.running.set()
+        self.thread = threading.Thread(
+            target=self.sample, name="profiler", daemon=True
+        )
+        self.thread.start()
+        log.info("Sampling every %ss.", self.interval, code="PROFILER")
+
+    def stop(self):
+        self.running.clear()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        with open(self.path, "w") as profile:
+            for stack, count in self.samples.most_common():
+                profile.write(f"{stack} {count}\n")
+        log.info(
+            "%s samples in %s",
+            sum(self.samples.values()),
+            self.path,
+            code="PROFILER",
+        )
+
+    def sample(self):
+        own = threading.get_ident()
+        while self.running.is_set():
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack: list[str] = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+
+def install_profiler(
+    signal_name: str = config["metrics"]["profile_signal"],
+) -> Profiler | None:
+    """Toggles a `Profiler` on the signal, from the main thread only."""
+    if not signal_name:
+        return None
+
+    profiler = Profiler()
+    signal.signal(getattr(signal, signal_name), profiler.toggle)
+    return profiler
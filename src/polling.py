@@ -0,0 +1,419 @@
+from collections import deque
+from typing import AsyncIterator, Iterable, Iterator
+import asyncio, heapq, math, select, socket, time
+
+from config import config
+from data.models import PollSlot, ScanReport, SensorState
+from data.protocol import FrameBuffer, SensorProtocol
+from metrics import Histogram
+
+
+class PollWindow:
+    """In-flight Window of Sensor Read Requests
+
+    Tracks which sensors are waiting for an answer and when the next request
+    frame is allowed to go out on the bus:
+
+    + At most `window` requests are in flight at the same time.
+    + Two consecutive request frames are at least `frame_spacing` seconds
+    apart.
+    + The same sensor is not polled again before `sensor_spacing` seconds.
+
+    Responses are matched back to sensors by the frame's address byte. A
+    disconnected sensor answers with `00` address, so it's matched to the
+    oldest in-flight request as gateway answers in order.
+    """
+
+    def __init__(
+        self,
+        window: int = config["polling"]["window"],
+        frame_spacing: float = config["polling"]["frame_spacing"],
+        sensor_spacing: float = config["polling"]["sensor_spacing"],
+        response_timeout: float = config["polling"]["response_timeout"],
+    ):
+        self.window = max(1, window)
+        self.frame_spacing = frame_spacing
+        self.sensor_spacing = sensor_spacing
+        self.response_timeout = response_timeout
+
+        # (sensor_id, address, sent_at) in send order
+        self.in_flight: deque[tuple[str, int | None, float]] = deque()
+        self.last_sent: dict[str, float] = {}
+        self.last_frame: float = 0.0
+
+    def is_full(self) -> bool:
+        return len(self.in_flight) >= self.window
+
+    def send_delay(self, sensor_id: str, now: float) -> float:
+        """Seconds to wait before `sensor_id` can be requested."""
+        return max(
+            0.0,
+            self.last_frame + self.frame_spacing - now,
+            self.last_sent.get(sensor_id, -self.sensor_spacing)
+            + self.sensor_spacing
+            - now,
+        )
+
+    def sent(self, sensor_id: str, address: int | None, now: float):
+        self.in_flight.append((sensor_id, address, now))
+        self.last_sent[sensor_id] = now
+        self.last_frame = now
+
+    def match(self, address: int) -> tuple[str, float] | None:
+        """Removes and returns the in-flight `(sensor_id, sent_at)` answered
+        by `address`, `None` when no in-flight sensor has this address."""
+        if not self.in_flight:
+            return None
+
+        # Disconnected sensor
+        if address == 0:
+            sensor_id, _, sent_at = self.in_flight.popleft()
+            return sensor_id, sent_at
+
+        for index, (sensor_id, sensor_address, sent_at) in enumerate(
+            self.in_flight
+        ):
+            if sensor_address == address:
+                del self.in_flight[index]
+                return sensor_id, sent_at
+
+    def expired(self, now: float) -> list[str]:
+        """Removes and returns sensors that didn't answer in time."""
+        expired: list[str] = []
+        while self.in_flight and (
+            now - self.in_flight[0][2] >= self.response_timeout
+        ):
+            expired.append(self.in_flight.popleft()[0])
+        return expired
+
+    def wait_time(self, now: float, next_sensor: str | None) -> float:
+        """How long the poller can wait for data before it has to send a
+        frame or expire a request."""
+        deadlines: list[float] = []
+        if self.in_flight:
+            deadlines.append(self.in_flight[0][2] + self.response_timeout - now)
+        if next_sensor is not None and not self.is_full():
+            deadlines.append(self.send_delay(next_sensor, now))
+        return max(0.0, min(deadlines)) if deadlines else 0.0
+
+
+class PollScheduler:
+    """Adaptive Poll Scheduler of a Floor
+
+    Gives every sensor its own poll interval instead of polling the whole
+    floor at the same rate:
+
+    + A sensor is polled every `transitions_per_poll / rate` seconds, within
+    `min_interval` and `max_interval`, where `rate` is its free/occupied
+    transitions per second, exponentially decayed over `rate_window`.
+    + Disconnected sensors (`00` answer) are polled every
+    `disconnected_interval` seconds. An unanswered or undecodable poll is
+    retried at the sensor's interval, and only `max_misses` of them in a
+    row move it to `disconnected_interval`.
+    + When the intervals add up to more than `budget` requests per second
+    (`0` for no limit), all of them are stretched to stay within it.
+
+    Next due times are kept in a heap; outdated entries are skipped when
+    they reach the top.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = config["polling"]["min_interval"],
+        max_interval: float = config["polling"]["max_interval"],
+        disconnected_interval: float = config["polling"]["disconnected_interval"],
+        transitions_per_poll: float = config["polling"]["transitions_per_poll"],
+        rate_window: float = config["polling"]["rate_window"],
+        budget: float = config["polling"]["budget"],
+        max_misses: int = config["polling"]["max_misses"],
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.disconnected_interval = disconnected_interval
+        self.transitions_per_poll = transitions_per_poll
+        self.rate_window = rate_window
+        self.budget = budget
+        self.max_misses = max(1, max_misses)
+
+        self.sensors: tuple[str, ...] = ()
+        self.slots: dict[str, PollSlot] = {}
+        # (due_at, sequence, sensor_id), sequence keeps equal times in order
+        self.heap: list[tuple[float, int, str]] = []
+        self.sequence: int = 0
+        # Requests per second of all the slots' intervals
+        self.load: float = 0.0
+
+    def layout(self, sensors: tuple[str, ...], now: float):
+        """Adds new sensors, due now, and forgets removed ones."""
+        if sensors == self.sensors:
+            return
+
+        self.sensors = sensors
+        for sensor_id in self.slots.keys() - set(sensors):
+            self.load -= 1 / self.slots.pop(sensor_id).interval
+        for sensor_id in sensors:
+            if sensor_id not in self.slots:
+                slot = self.slots[sensor_id] = PollSlot(
+                    sensor_id, self.max_interval, now
+                )
+                self.load += 1 / slot.interval
+                self.push(slot)
+
+    def push(self, slot: PollSlot):
+        self.sequence += 1
+        heapq.heappush(self.heap, (slot.due_at, self.sequence, slot.sensor_id))
+
+    def stretch(self) -> float:
+        if not self.budget:
+            return 1.0
+        return max(1.0, self.load / self.budget)
+
+    def reschedule(self, slot: PollSlot, interval: float, now: float):
+        self.load += 1 / interval - 1 / slot.interval
+        slot.interval = interval
+        slot.due_at = now + interval * self.stretch()
+        self.push(slot)
+
+    def head(self) -> tuple[float, int, str] | None:
+        """Earliest entry of the heap, dropping outdated ones."""
+        while self.heap:
+            due_at, _, sensor_id = self.heap[0]
+            slot = self.slots.get(sensor_id)
+            if slot and slot.due_at == due_at:
+                return self.heap[0]
+            heapq.heappop(self.heap)
+        return None
+
+    def due(self, now: float) -> list[str]:
+        """Returns sensors due to be polled now.
+
+        They're tentatively rescheduled by their current interval, in case
+        the scan doesn't get to `record` them.
+        """
+        sensors: list[str] = []
+        while (entry := self.head()) and entry[0] <= now:
+            heapq.heappop(self.heap)
+            slot = self.slots[entry[2]]
+            sensors.append(slot.sensor_id)
+            self.reschedule(slot, slot.interval, now)
+        return sensors
+
+    def wait_time(self, now: float) -> float | None:
+        """Seconds until the next sensor is due, `None` without sensors."""
+        entry = self.head()
+        return max(0.0, entry[0] - now) if entry else None
+
+    def record(self, sensor_id: str, state: SensorState | None, now: float):
+        """Updates the sensor's transition rate and reschedules it."""
+        slot = self.slots.get(sensor_id)
+        if slot is None:
+            return
+
+        # Lost or corrupted frame, the known state and rate are kept.
+        if state is None:
+            slot.misses += 1
+            interval = (
+                self.disconnected_interval
+                if slot.misses >= self.max_misses
+                else slot.interval
+            )
+            self.reschedule(slot, interval, now)
+            return
+
+        slot.misses = 0
+        if slot.polled_at is not None:
+            slot.rate *= math.exp((slot.polled_at - now) / self.rate_window)
+        if (
+            state in (SensorState.free, SensorState.occupied)
+            and slot.state in (SensorState.free, SensorState.occupied)
+            and state != slot.state
+        ):
+            slot.rate += 1 / self.rate_window
+        slot.polled_at = now
+        slot.state = state
+
+        if state == SensorState.disconnected:
+            interval = self.disconnected_interval
+        elif slot.rate:
+            interval = min(
+                self.max_interval,
+                max(self.min_interval, self.transitions_per_poll / slot.rate),
+            )
+        else:
+            interval = self.max_interval
+        self.reschedule(slot, interval, now)
+
+
+class SensorPoller:
+    """Pipelined Sensor Poller
+
+    Keeps up to `window` read commands in flight on the gateway socket
+    instead of waiting for every answer, so a floor scan is bounded by the
+    gateway's bus speed. Responses are received into a reusable
+    `FrameBuffer` and decoded by `SensorProtocol` without intermediate
+    copies.
+
+    Args:
+        client (socket): Connected gateway socket.
+        window (PollWindow): In-flight window configurations.
+        response_seconds (metrics.Histogram): Observes request to response
+        latency of every answered sensor.
+    """
+
+    def __init__(
+        self,
+        client: socket.socket,
+        window: PollWindow | None = None,
+        response_seconds: Histogram | None = None,
+    ):
+        self.client = client
+        self.window = window or PollWindow()
+        self.response_seconds = response_seconds
+        self.protocol = SensorProtocol()
+        self.buffer = FrameBuffer(self.protocol.frame_length)
+        self.last_scan: ScanReport | None = None
+        # Silence since the last answer: finished waits, and the start of
+        # the current wait for the requests in flight
+        self.silence: float = 0.0
+        self.waiting_since: float | None = None
+        # (sent_at, received_at) of the last yielded response
+        self.read_at: tuple[float, float] | None = None
+
+    def send_due(self, pending: deque[str], now: float) -> list[bytes]:
+        """Pops sensors that can be requested now and returns their frames."""
+        frames: list[bytes] = []
+        while (
+            pending
+            and not self.window.is_full()
+            and self.window.send_delay(pending[0], now) == 0
+        ):
+            sensor_id = pending.popleft()
+            frames.append(self.protocol.request(sensor_id))
+            self.window.sent(sensor_id, self.protocol.address(sensor_id), now)
+            if self.waiting_since is None:
+                self.waiting_since = now
+        return frames
+
+    def expired(self, now: float) -> list[str]:
+        """Expires unanswered requests, and ends the wait once none is in
+        flight, so the idle time until the next poll is not silence."""
+        expired = self.window.expired(now)
+        if not self.window.in_flight and self.waiting_since is not None:
+            self.silence += now - self.waiting_since
+            self.waiting_since = None
+        return expired
+
+    def received(self) -> Iterator[tuple[str, SensorState | None]]:
+        """Matches and decodes complete frames of the buffer."""
+        now = time.monotonic()
+        for frame in self.buffer.frames(self.protocol.is_valid):
+            matched = self.window.match(frame[0])
+            if matched is not None:
+                sensor_id, sent_at = matched
+                # Gateway answered, requests still in flight wait from when
+                # they're sent
+                self.silence = 0.0
+                self.waiting_since = (
+                    self.window.in_flight[0][2] if self.window.in_flight else None
+                )
+                if self.response_seconds:
+                    self.response_seconds.observe(now - sent_at)
+                self.read_at = (sent_at, now)
+                yield sensor_id, self.protocol.decode(frame)
+
+    def report(
+        self, floor: int | None, responses: int, timeouts: int, started: float
+    ):
+        now = time.monotonic()
+        silent_for = self.silence
+        if self.waiting_since is not None:
+            silent_for += now - self.waiting_since
+        self.last_scan = ScanReport(
+            floor=floor,
+            sensors=responses + timeouts,
+            responses=responses,
+            timeouts=timeouts,
+            duration=now - started,
+            silent_for=silent_for,
+        )
+
+    def scan(
+        self, sensors: Iterable[str], floor: int | None = None
+    ) -> Iterator[tuple[str, SensorState | None]]:
+        """Polls every sensor once.
+
+        Yields:
+            (sensor_id, state): Decoded sensor state, or `None` if sensor
+            didn't answer in `response_timeout` or its status is unknown.
+        """
+        pending: deque[str] = deque(sensors)
+        responses = timeouts = 0
+        started = time.monotonic()
+
+        while pending or self.window.in_flight:
+            now = time.monotonic()
+
+            for frame in self.send_due(pending, now):
+                self.client.sendall(frame)
+
+            for sensor_id in self.expired(now):
+                timeouts += 1
+                yield sensor_id, None
+
+            timeout = self.window.wait_time(now, pending[0] if pending else None)
+            readable, _, _ = select.select([self.client], [], [], timeout)
+            if not readable:
+                continue
+
+            self.buffer.recv_into(self.client)
+            for sensor_id, state in self.received():
+                responses += 1
+                yield sensor_id, state
+
+        self.report(floor, responses, timeouts, started)
+
+
+class AsyncSensorPoller(SensorPoller):
+    """Pipelined Sensor Poller on asyncio
+
+    Same window, matching and decoding as `SensorPoller` on a non-blocking
+    socket, so many gateways can be polled from one event loop.
+
+    Args:
+        client (socket): Connected non-blocking gateway socket.
+        window (PollWindow): In-flight window configurations.
+    """
+
+    async def scan(
+        self, sensors: Iterable[str], floor: int | None = None
+    ) -> AsyncIterator[tuple[str, SensorState | None]]:
+        loop = asyncio.get_running_loop()
+        pending: deque[str] = deque(sensors)
+        responses = timeouts = 0
+        started = time.monotonic()
+
+        while pending or self.window.in_flight:
+            now = time.monotonic()
+
+            for frame in self.send_due(pending, now):
+                await loop.sock_sendall(self.client, frame)
+
+            for sensor_id in self.expired(now):
+                timeouts += 1
+                yield sensor_id, None
+
+            timeout = self.window.wait_time(now, pending[0] if pending else None)
+            try:
+                received = await asyncio.wait_for(
+                    loop.sock_recv_into(self.client, self.buffer.writable()),
+                    timeout,
+                )
+            except TimeoutError:
+                continue
+
+            self.buffer.written(received)
+            for sensor_id, state in self.received():
+                responses += 1
+                yield sensor_id, state
+
+        self.report(floor, responses, timeouts, started)
@@ -1,34 +1,136 @@
+from __future__ import annotations
+
 from dataclasses import asdict
-import socket, time
+from typing import TYPE_CHECKING
+import json, select, socket, time
 
 from config import config
-from data.models import error_code, Log, AMQPLoggingMessage, SensorsLogging
-from data.controllers import Controllers
+from data.models import (
+    error_code,
+    Log,
+    AMQPLoggingMessage,
+    BarrierCommand,
+    BarrierLogging,
+    ReadingTrace,
+    RFIDLogging,
+    ScanReport,
+    SensorsLogging,
+    SensorState,
+)
 from data import mq
+from data.commands import BarrierCommandQueue
+from data.history import OccupancyHistory, occupancy_history
+from data.occupancy import FloorOccupancy
+from data.protocol import BarrierProtocol, DelimitedFrameBuffer
+from data.state import SensorStateTable, TagDeduplicator
+import metrics
+from polling import PollScheduler, SensorPoller
+from logger import get_logger
+from supervisor import Supervisor
+
+# MongoDB and Redis clients are imported by the sections using them.
+if TYPE_CHECKING:
+    from data.controllers import Controllers, TagIndex
+    from data.live import LiveSlotCache
+
+
+log = get_logger(__name__)
 
 
 class AppSections:
     message_broker: any = None
     queue_route: str = ""
     queue_namespace_provider: str = ""
-    sensor_collections: Controllers
 
-    def __init__(self, ip: str, port: int, building: str, queue_name: str):
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        building: str,
+        queue_name: str,
+        message_broker: mq.RabbitMQ | None = None,
+        sensor_collections: Controllers | None = None,
+        section: str = "sensors",
+        live_slots: LiveSlotCache | None = None,
+        history: OccupancyHistory | None = None,
+    ):
+        """Application Section of a Gateway
+
+        Args:
+            message_broker, sensor_collections, live_slots, history: Shared
+            broker, database controllers, Redis live slot cache and
+            occupancy history, e.g. when one process collects many gateways.
+            MongoDB is connected when the section first uses it.
+            section (str): Section name of the metrics labels.
+        """
         self.ip = ip
         self.port = port
         self.building = building
         self.queue_name = queue_name
-        self.message_broker = mq.RabbitMQ()
+        spool = config["mq"]["spool"]["directory"]
+        self.message_broker = message_broker or mq.RabbitMQ(
+            # One spool per gateway process
+            spool_directory=f"{spool}.{ip}-{port}" if spool else ""
+        )
+
+        self._sensor_collections = sensor_collections
+        self.sensor_states = SensorStateTable(config["polling"]["heartbeat"])
+        self.occupancy = FloorOccupancy(building)
+        self.occupancy_sent_at: float = 0.0
+        self.live_slots = live_slots
+        if live_slots is None and section == "sensors":
+            from data.live import live_slot_cache
 
-        self.sensor_collections = Controllers(building, ip)
+            self.live_slots = live_slot_cache()
+        self.history = history
+        if history is None and section == "sensors":
+            self.history = occupancy_history()
+        self.tags: TagIndex | None = None
+        self.tag_reads = TagDeduplicator(
+            config["client_commands"]["rfid"]["dedup_window"]
+        )
+        self.trace_payload: bool = config["tracing"]["payload"]
+        self.commands = BarrierCommandQueue(
+            config["client_commands"]["barrier"]["max_in_flight"]
+        )
+        self.consuming: bool = False
+        self.supervisor = Supervisor(f"Gateway {ip}:{port}")
+        self.scheduler = PollScheduler()
+        self.metrics = metrics.SectionMetrics(building, ip, section)
+        self.metrics.downtime.set_function(lambda: self.supervisor.stats.downtime)
+        self.metrics.states(self.sensor_states)
 
-    def send_event(self, data: dict):
+    @property
+    def sensor_collections(self) -> Controllers:
+        if self._sensor_collections is None:
+            from data.controllers import Controllers
+
+            self._sensor_collections = Controllers(self.building, self.ip)
+        return self._sensor_collections
+
+    def send_event(
+        self,
+        data: dict,
+        queue_route: str | None = None,
+        queue_namespace_provider: str | None = None,
+        trace: ReadingTrace | None = None,
+    ):
         """Send proper event by payload to RabbitMQ.
 
         Args:
             data (dict): The simple dictionary includes the client IP address
             and other related data.
+            queue_route, queue_namespace_provider (str): Overrides section's
+            route and Laravel job namespace.
+            trace (ReadingTrace): Stages of a sensor reading, observed by
+            `reading_stage_seconds` and added as `trace` field when
+            `config["tracing"]["payload"]` is on.
         """
+        started = time.perf_counter()
+        queue_route = queue_route or self.queue_route
+        queue_namespace_provider = (
+            queue_namespace_provider or self.queue_namespace_provider
+        )
 
         # Final data to send it to RabbitMQ
         results = {"ip_address": self.ip}
@@ -36,48 +138,65 @@ class AppSections:
         # Updates `results` from new data dictionary.
         for k, v in data.items():
             results[k] = v
+        if trace:
+            trace.handled = time.monotonic()
+            if self.trace_payload:
+                results["trace"] = trace.fields()
 
-        self.message_broker.produce(
-            self.queue_name,
-            self.queue_route,
-            message=self.message_broker.laravel_based_messaging(
-                namespace=self.queue_namespace_provider,
-                data=results,
-            ),
+        message = self.message_broker.laravel_based_messaging(
+            namespace=queue_namespace_provider,
+            data=results,
         )
+        if trace:
+            trace.enveloped = time.monotonic()
+            self.metrics.bus_seconds.observe(trace.received - trace.sent)
+            self.metrics.handle_seconds.observe(trace.handled - trace.received)
+            self.metrics.envelope_seconds.observe(trace.enveloped - trace.handled)
+        try:
+            self.message_broker.produce(
+                self.queue_name,
+                queue_route,
+                message=message,
+                traced_at=trace.sent if trace else None,
+            )
+        except mq.BrokerNotConnected:
+            # Broker outage, replayed from the spool once it's back.
+            self.message_broker.spool_message(
+                self.queue_name, queue_route, message
+            )
+        self.metrics.publish_seconds.observe(time.perf_counter() - started)
+        if trace:
+            self.metrics.produce_seconds.observe(time.monotonic() - trace.enveloped)
 
     def socket_connection(self, callback=None):
         """Public Data Collector
 
+        Reconnects the gateway with `supervisor` backoff whenever the socket
+        fails, until the callback returns.
+
         Args:
             callback (client: socket): Call `sensors`, `barriers`, `rfids` and
             other client's function here.
         """
-        # while True:
-        try:
-            client: socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.connect((self.ip, self.port))
-            client.settimeout(2)
+        if not callback:
+            log.error("Error in callback function.", code="CODE")
+            return
 
-            if callback:
+        while True:
+            client: socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                client.settimeout(2)
+                client.connect((self.ip, self.port))
+                self.metrics.connects.inc()
                 callback(client)
-            else:
-                raise Exception("[CODE]: Error in callback function.")
-
-        except socket.error:
-            print("[SOCKET]: Access is closed.")
-        except socket.gaierror:
-            print("[SOCKET]: DNS is not exists.")
-        except ConnectionAbortedError:
-            print("[SOCKET]: The Connection is terminated by one of the parties.")
-        except ConnectionRefusedError:
-            print("[SOCKET]: The Connection refused.")
-        except ConnectionResetError:
-            print("[SOCKET]: The Connection closed with another gateway.")
-        except socket.timeout:
-            print("[SOCKET]: Connection timeout")
-        except OSError as os_conn_error:
-            print(f"[CONNECTION]: Gateway is not responding. {os_conn_error}")
+                return
+            except OSError as socket_error:
+                self.metrics.error(socket_error)
+                log_socket_error(socket_error, self.ip)
+            finally:
+                client.close()
+
+            time.sleep(self.supervisor.failed())
 
     def get_sensors_data(self, client: socket):
         """Get Sensors Data
@@ -88,79 +207,478 @@ class AppSections:
         # Descriptions:
 
         This script sends request to network socket server and request format is
-        compound of `sensor_id` and default read sensor command.
-
-        After script got client response form gateway board, at slice of `12:14`
-        we specify that slot is free or occupied:
+        compound of `sensor_id` and default read sensor command. Sensors are
+        polled when `PollScheduler` has them due, and requests are pipelined
+        by `SensorPoller` within `config["polling"]` window and spacing.
+        Every scan reports its duration.
 
-        + 12:14 was equal to `00`: free
-        + 12:14 was equal to `01`: occupied
-        + 0:2 was equal to `00`: sensor is disconnected
+        Every response is handled by `handle_sensor_response`. A topology
+        that couldn't be loaded is retried, only a missing floor stops the
+        section.
         """
+        from data.controllers import TopologyUnavailable
 
         # Initialize `sensor_logging`
         sensor_logging: SensorsLogging = SensorsLogging(None, None, None)
+        poller: SensorPoller = SensorPoller(
+            client, response_seconds=self.metrics.response_seconds
+        )
 
+        self.sensor_collections.topology.watch()
         while True:
-            # Sensors list that exists in a specific floor
-            sensors = self.sensor_collections.get_sensors()
+            # Sensors list that exists in a specific floor, served from the
+            # topology cache without any database round trip.
+            try:
+                sensors = self.sensor_collections.get_sensors()
+            except TopologyUnavailable as e:
+                log.warning("%s Retrying.", e, code="MONGODB")
+                time.sleep(config["db"]["mongo"]["topology_retry"])
+                continue
 
             # Floor not found for this building name and IP address.
             if sensors == None:
-                sensor_logging.message = (
-                    AMQPLoggingMessage(
-                        level=Log.critical.name,
-                        content=error_code["sections"]["critical"]["floorNotFound"],
-                    ),
-                )
-                self.send_event(data=asdict(sensor_logging))
+                self.send_floor_not_found(sensor_logging)
                 break
 
-            for i in range(self.sensor_collections.get_sensors_count()):
-                sensor_id: str = sensors[i]["id"]
-                sensor_logging.sensor_id = sensor_id
+            due = self.due_sensors(self.sensor_collections.get_floors(), sensors)
+            if not due:
+                time.sleep(self.idle_time())
+                continue
 
-                # Sensor's read command in HEX format
-                client.send(
-                    f"{sensor_id}{config["client_commands"]["sensor_read"]}".encode()
+            for sensor_id, state in poller.scan(due, floor=self.occupancy.floor):
+                self.handle_sensor_response(
+                    sensor_logging, sensor_id, state, poller.read_at
                 )
-                sensor_response: str = client.recv(1024).hex()
-
-                # Sensor is not connect
-                if sensor_response[0:2] == "00":
-                    sensor_logging.message = (
-                        AMQPLoggingMessage(
-                            level=Log.warning.name,
-                            content=error_code["sections"]["warning"][
-                                "sensorsIsDisconnected"
-                            ],
-                        ),
-                    )
-                    self.send_event(data=asdict(sensor_logging))
-                else:
-                    # Slot is free
-                    if sensor_response[12:14] == "00":
-                        sensor_logging.status = False
-                        sensor_logging.message = (
-                            AMQPLoggingMessage(
-                                level=Log.info.name,
-                                content=error_code["sections"]["success"][
-                                    "globalStatus"
-                                ],
-                            ),
-                        )
-                        self.send_event(data=asdict(sensor_logging))
-                    # Slot is occupied
-                    elif sensor_response[12:14] == "01":
-                        sensor_logging.status = True
-                        sensor_logging.message = (
-                            AMQPLoggingMessage(
-                                level=Log.info.name,
-                                content=error_code["sections"]["success"][
-                                    "globalStatus"
-                                ],
-                            ),
+            self.report_scan(poller.last_scan)
+
+    def due_sensors(self, floor: int | None, sensors: tuple[str, ...]) -> list[str]:
+        """Lays out the floor and returns its sensors due to be polled by
+        the `scheduler`."""
+        now = time.monotonic()
+        self.occupancy.layout(floor, sensors)
+        self.scheduler.layout(sensors, now)
+        return self.scheduler.due(now)
+
+    def idle_time(self) -> float:
+        """Seconds to wait for the next due sensor, at most `sensor_spacing`
+        to keep up with topology changes."""
+        wait = self.scheduler.wait_time(time.monotonic())
+        spacing = config["polling"]["sensor_spacing"]
+        return spacing if wait is None else min(wait, spacing)
+
+    def get_rfid_data(self, client: socket):
+        """Get RFID Data
+
+        # Args:
+            client (socket):
+
+        # Descriptions:
+
+        The reader streams a line per tag read (`config["client_commands"]
+        ["rfid"]`). Lines are received into a reusable buffer as soon as the
+        socket is readable, so a tag is published right after it's read.
+
+        Repeated reads of a tag are dropped by `tag_reads`, and tags are
+        resolved against the in-memory `TagIndex` of the building. Every new
+        tag is handled by `handle_tag`.
+        """
+        rfid = config["client_commands"]["rfid"]
+        buffer = DelimitedFrameBuffer(
+            rfid["delimiter"].encode(), rfid["max_frame_length"]
+        )
+        rfid_logging: RFIDLogging = RFIDLogging(None, False, None, None)
+        if self.tags is None:
+            from data.controllers import TagIndex
+
+            self.tags = TagIndex(
+                self.sensor_collections.db_connection,
+                self.building,
+                config["db"]["mongo"]["tag_ttl"],
+            )
+            self.tags.start()
+
+        # Readers are silent while no car is in the lane, dead connections
+        # are detected by TCP keepalive instead.
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.supervisor.connected()
+
+        while True:
+            readable, _, _ = select.select([client], [], [], 1.0)
+            now = time.monotonic()
+            self.tag_reads.prune(now)
+            if not readable:
+                continue
+
+            buffer.recv_into(client)
+            for frame in buffer.frames():
+                tag = bytes(frame).decode("ascii", "replace").strip().upper()
+                if not tag:
+                    continue
+
+                self.metrics.responses.inc()
+                if self.tag_reads.is_new(tag, now):
+                    try:
+                        self.handle_tag(rfid_logging, tag)
+                    except (TypeError, ValueError) as e:
+                        # Unserializable card, the reader keeps going.
+                        self.metrics.error(e)
+                        log.error(
+                            "Tag %s is not published. %s", tag, e, code="RFID"
                         )
-                        self.send_event(data=asdict(sensor_logging))
 
-                time.sleep(0.8)
+    def handle_tag(self, rfid_logging: RFIDLogging, tag: str):
+        """Publishes a tag read with its registered card, if any."""
+        card = self.tags.get(tag)
+        rfid_logging.tag = tag
+        rfid_logging.registered = card is not None
+        rfid_logging.card = card
+        if card is None:
+            rfid_logging.message = (
+                AMQPLoggingMessage(
+                    level=Log.warning.name,
+                    content=error_code["sections"]["warning"]["unregisteredTag"],
+                ),
+            )
+        else:
+            rfid_logging.message = (
+                AMQPLoggingMessage(
+                    level=Log.info.name,
+                    content=error_code["sections"]["success"]["tagRead"],
+                ),
+            )
+        self.send_event(data=asdict(rfid_logging))
+
+    def get_barrier_data(self, client: socket):
+        """Get Barrier Data
+
+        # Args:
+            client (socket):
+
+        # Descriptions:
+
+        Open and close commands of the gateway's barriers are consumed from
+        its `config["client_commands"]["barrier"]` queue into the bounded
+        `commands` queues, as soon as they're published, and executed in
+        turn on the persistent controller connection by `execute_command`.
+
+        Every command is reported with its status and latency by
+        `report_command`, and then acknowledged to the broker.
+        """
+        barrier = config["client_commands"]["barrier"]
+        protocol = BarrierProtocol()
+        if not self.consuming:
+            self.message_broker.consume(
+                f"{barrier['queue']}.{self.building}.{self.ip}",
+                f"{barrier['route']}.{self.building}.{self.ip}",
+                self.receive_command,
+                barrier["prefetch"],
+                self.cancel_commands,
+            )
+            self.consuming = True
+
+        # Controllers are silent between commands, dead connections are
+        # detected by TCP keepalive instead.
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.supervisor.connected()
+
+        while True:
+            for command in self.commands.take_rejected():
+                self.report_command(command, "rejected")
+
+            command = self.commands.take(1.0)
+            if command is not None:
+                self.execute_command(client, protocol, command)
+
+    def receive_command(self, body: bytes, ack):
+        """Queues a consumed barrier command, runs in the broker's I/O
+        thread.
+
+        Command is a JSON object of `barrier` id, `command` (`open` or
+        `close`) and optional `id`, returned in its report.
+        """
+        try:
+            data = json.loads(body)
+            command = BarrierCommand(
+                data.get("id"),
+                str(data["barrier"]),
+                data["command"],
+                time.monotonic(),
+                ack,
+            )
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            log.warning(
+                "Invalid barrier command. %s",
+                e,
+                code="BARRIER",
+                fields={"gateway": self.ip},
+            )
+            ack()
+            return
+
+        self.commands.put(command)
+
+    def cancel_commands(self):
+        """Drops queued commands of a closed broker channel, runs in the
+        broker's I/O thread. Their acknowledgements would be lost, and the
+        broker redelivers them on the next channel."""
+        dropped = self.commands.clear()
+        if dropped:
+            log.warning(
+                "%s barrier commands dropped, they're redelivered.",
+                dropped,
+                code="BARRIER",
+                fields={"gateway": self.ip},
+            )
+
+    def execute_command(
+        self, client: socket, protocol: BarrierProtocol, command: BarrierCommand
+    ):
+        """Sends a command to the controller and waits for its
+        acknowledgement, up to `command_timeout` seconds.
+
+        Raises:
+            socket.timeout: Controller didn't acknowledge the command, the
+            connection is reopened to drop any late response.
+        """
+        barrier = config["client_commands"]["barrier"]
+        if time.monotonic() - command.received_at > barrier["max_age"]:
+            self.report_command(command, "expired")
+            return
+
+        try:
+            request = protocol.request(command.barrier, command.command)
+        except ValueError as e:
+            log.warning("%s", e, code="BARRIER", fields={"gateway": self.ip})
+            self.report_command(command, "rejected")
+            return
+
+        try:
+            client.sendall(request)
+            acknowledged = receive_echo(
+                client, request, barrier["command_timeout"]
+            )
+        except OSError:
+            self.report_command(command, "timeout")
+            raise
+
+        if not acknowledged:
+            self.report_command(command, "rejected")
+            raise ConnectionAbortedError("Unexpected barrier controller response.")
+
+        self.report_command(
+            command, "executed", time.monotonic() - command.received_at
+        )
+
+    def report_command(
+        self, command: BarrierCommand, status: str, latency: float | None = None
+    ):
+        """Publishes a command's status and acknowledges its delivery."""
+        codes = error_code["sections"]
+        match status:
+            case "executed":
+                level, content = Log.info, codes["success"]["barrierCommand"]
+            case "timeout":
+                level, content = Log.critical, codes["critical"]["barrierTimeout"]
+            case _:
+                level = Log.warning
+                content = codes["warning"]["barrierCommandRejected"]
+
+        self.metrics.command(status)
+        if latency is not None:
+            self.metrics.command_seconds.observe(latency)
+        log.debug(
+            "Barrier %s %s command %s",
+            command.barrier,
+            command.command,
+            status,
+            code="BARRIER",
+            fields={"gateway": self.ip, "latency": latency},
+        )
+
+        self.send_event(
+            data=asdict(
+                BarrierLogging(
+                    barrier=command.barrier,
+                    command=command.command,
+                    command_id=command.id,
+                    status=status,
+                    latency=latency,
+                    message=(
+                        AMQPLoggingMessage(level=level.name, content=content),
+                    ),
+                )
+            )
+        )
+        if command.ack:
+            command.ack()
+
+    def send_floor_not_found(self, sensor_logging: SensorsLogging):
+        sensor_logging.message = (
+            AMQPLoggingMessage(
+                level=Log.critical.name,
+                content=error_code["sections"]["critical"]["floorNotFound"],
+            ),
+        )
+        self.send_event(data=asdict(sensor_logging))
+
+    def handle_sensor_response(
+        self,
+        sensor_logging: SensorsLogging,
+        sensor_id: str,
+        state: SensorState | None,
+        read_at: tuple[float, float] | None = None,
+    ):
+        """Publishes a sensor's decoded state when it changed.
+
+        Unchanged states are only published as `sensor_states` heartbeat.
+        See `SensorProtocol` for the response frame.
+
+        Args:
+            read_at (tuple): `time.monotonic()` the request was sent and its
+            response received, traced through to the broker's confirm.
+        """
+        self.scheduler.record(sensor_id, state, time.monotonic())
+
+        # Sensor didn't answer in `response_timeout` or unknown status
+        if state is None:
+            return
+
+        if self.occupancy.update(sensor_id, state) and self.history:
+            self.history.transition(
+                self.building, self.occupancy.floor, sensor_id, state
+            )
+        if self.live_slots:
+            self.live_slots.update(
+                self.building, self.occupancy.floor, sensor_id, state
+            )
+        if not self.sensor_states.update(sensor_id, state, time.monotonic()):
+            return
+
+        sensor_logging.sensor_id = sensor_id
+        if state == SensorState.disconnected:
+            sensor_logging.message = (
+                AMQPLoggingMessage(
+                    level=Log.warning.name,
+                    content=error_code["sections"]["warning"][
+                        "sensorsIsDisconnected"
+                    ],
+                ),
+            )
+        else:
+            sensor_logging.status = state == SensorState.occupied
+            sensor_logging.message = (
+                AMQPLoggingMessage(
+                    level=Log.info.name,
+                    content=error_code["sections"]["success"]["globalStatus"],
+                ),
+            )
+        self.send_event(
+            data=asdict(sensor_logging),
+            trace=ReadingTrace(*read_at) if read_at else None,
+        )
+
+    def send_occupancy(self):
+        """Publishes the floor occupancy snapshot on its own route, when it
+        changed or every `config["occupancy"]["interval"]` seconds."""
+        now = time.monotonic()
+        if not (
+            (config["occupancy"]["on_change"] and self.occupancy.changed)
+            or now - self.occupancy_sent_at >= config["occupancy"]["interval"]
+        ):
+            return
+
+        self.occupancy_sent_at = now
+        self.send_event(
+            data=self.occupancy.snapshot(),
+            queue_route=config["occupancy"]["route"],
+            queue_namespace_provider=config["occupancy"]["namespace"],
+        )
+
+    def report_scan(self, report: ScanReport) -> int:
+        """Logs the floor scan report, publishes the floor occupancy
+        snapshot, writes the live slot states and samples the history, marks
+        the gateway as up when it answered and returns count of polled
+        sensors.
+
+        Raises:
+            socket.timeout: Gateway didn't answer any request for
+            `config["polling"]["silence_timeout"]` seconds.
+        """
+        log.debug(
+            "Floor %s scanned %s sensors in %.2fs",
+            report.floor,
+            report.sensors,
+            report.duration,
+            code="SENSORS",
+            fields={
+                "gateway": self.ip,
+                "timeouts": report.timeouts,
+                "emitted": self.sensor_states.emitted,
+                "suppressed": self.sensor_states.suppressed,
+            },
+        )
+
+        self.metrics.scan_seconds.observe(report.duration)
+        self.metrics.responses.inc(report.responses)
+        self.metrics.timeouts.inc(report.timeouts)
+
+        if report.sensors:
+            self.send_occupancy()
+            totals = self.occupancy.totals()
+            if self.live_slots:
+                # One pipelined round trip for the scan's states
+                self.live_slots.totals(self.building, self.occupancy.floor, totals)
+                self.live_slots.flush()
+            if self.history:
+                self.history.sample(self.building, self.occupancy.floor, totals)
+
+        if report.responses:
+            self.supervisor.connected()
+
+        # Gateway is silent
+        if report.silent_for >= config["polling"]["silence_timeout"]:
+            raise socket.timeout()
+
+        return report.sensors
+
+
+def receive_echo(client: socket, request: bytes, timeout: float) -> bool:
+    """Receives the echo of a request frame and returns whether it matches.
+
+    Raises:
+        socket.timeout: No complete echo in `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    response = bytearray()
+    while len(response) < len(request):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout()
+
+        client.settimeout(remaining)
+        chunk = client.recv(len(request) - len(response))
+        if not chunk:
+            raise ConnectionResetError("Controller closed the connection.")
+        response += chunk
+    return response == request
+
+
+def log_socket_error(socket_error: OSError, ip: str):
+    """Application-side log of a gateway socket error."""
+    code = "SOCKET"
+    match socket_error:
+        case socket.gaierror():
+            message = "DNS is not exists."
+        case ConnectionAbortedError():
+            message = "The Connection is terminated by one of the parties."
+        case ConnectionRefusedError():
+            message = "The Connection refused."
+        case ConnectionResetError():
+            message = "The Connection closed with another gateway."
+        case socket.timeout():
+            message = "Connection timeout"
+        case _:
+            code, message = "CONNECTION", "Gateway is not responding."
+    log.warning(
+        message, code=code, fields={"gateway": ip, "error": str(socket_error)}
+    )
@@ -0,0 +1,179 @@
+"""Gateway Service
+
+Runs the section of `config["service"]` with no operator at a terminal, e.g.
+under systemd or Kubernetes. Modules of a section are imported, and its
+connections opened, only when it runs, and none of them blocks the start:
+
++ RabbitMQ connects in background, messages wait in its outbox meanwhile.
++ MongoDB and Redis connect on their first query.
+
+Once the section is running, readiness is signalled by `ready_file`, the
+`/ready` metrics endpoint and systemd's `READY=1` (`NOTIFY_SOCKET`).
+SIGTERM stops the section, flushes its broker and snapshots the occupancy
+history.
+"""
+
+import atexit, os, signal, socket, sys, time
+
+from config import config
+from logger import get_logger, setup_logging
+import metrics
+
+
+log = get_logger("mci-gateway")
+
+started_at = time.monotonic()
+
+# Section: (queue_route, queue_namespace_provider, AppSections callback)
+sections: dict[str, tuple[str, str, str]] = {
+    "sensors": (
+        "logs.utlrasonic-sensors",
+        "App\\Jobs\\SystemLogs\\UltrasonicSensors\\SensorLog",
+        "get_sensors_data",
+    ),
+    "barriers": (
+        "logs.barriers",
+        "App\\Jobs\\SystemLogs\\Barriers\\BarrierLog",
+        "get_barrier_data",
+    ),
+    "rfid": (
+        "logs.rfids",
+        "App\\Jobs\\SystemLogs\\RFIDs\\RFIDLog",
+        "get_rfid_data",
+    ),
+}
+sections["barrier"] = sections["barriers"]
+
+
+class InputError(ValueError):
+    pass
+
+
+def building_name(building: str | int | None) -> str:
+    """Building by its name or its number (from 1) in `config["buildings"]`.
+
+    Raises:
+        InputError: Unknown building.
+    """
+    buildings = config["buildings"]
+    if building in buildings:
+        return building
+
+    try:
+        number = int(building)
+    except (TypeError, ValueError):
+        number = 0
+    if number < 1 or number > len(buildings):
+        raise InputError(
+            f"You must enter building number between 1 to {len(buildings)}"
+        )
+    return buildings[number - 1]
+
+
+def ready():
+    """Signals the orchestrator that the service is running."""
+    metrics.ready.set()
+
+    ready_file = config["service"]["ready_file"]
+    if ready_file:
+        with open(ready_file, "w") as file:
+            file.write(str(os.getpid()))
+        atexit.register(os.remove, ready_file)
+
+    notify_socket = os.environ.get("NOTIFY_SOCKET")
+    if notify_socket:
+        if notify_socket.startswith("@"):
+            # Abstract namespace socket
+            notify_socket = "\0" + notify_socket[1:]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify:
+            notify.sendto(b"READY=1", notify_socket)
+
+    log.info(
+        "Service is ready in %.0fms.",
+        (time.monotonic() - started_at) * 1000,
+        code="SERVICE",
+    )
+
+
+def run(service: dict = config["service"]):
+    """Runs the section, the collector or the shards of `service`.
+
+    Raises:
+        InputError: Invalid or missing service configuration.
+    """
+    building = building_name(service["building"])
+    section = service["section"]
+    if section not in sections:
+        raise InputError("Unknown section")
+    if service["gateways"] is None and (
+        service["ip"] is None or service["port"] is None
+    ):
+        raise InputError(
+            "Please enter valid ip address, port number, and an application section"
+        )
+    if service["gateways"] is not None and section != "sensors":
+        raise InputError("Collector mode only supports sensors section")
+
+    # Orchestrators stop the service by SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    setup_logging()
+    metrics.serve()
+    metrics.install_profiler()
+
+    port = int(service["port"]) if service["port"] else None
+    if service["gateways"] is not None and service["workers"] is not None:
+        run_shards(service["gateways"], building, port, int(service["workers"]))
+    elif service["gateways"] is not None:
+        run_collector(service["gateways"], building, port)
+    else:
+        run_section(section, service["ip"], port, building)
+
+
+def run_shards(source: str, building: str, port: int | None, workers: int):
+    # Gateways are sharded over `workers` processes, `0` for one per CPU
+    # core.
+    from shards import Coordinator
+
+    coordinator = Coordinator(
+        source, building, port, queue_name="logs", workers=workers
+    )
+    ready()
+    coordinator.run()
+
+
+def run_collector(source: str, building: str, port: int | None):
+    # One process collects every gateway of the JSON file or of the
+    # building's `GateWay` collection (`db`).
+    import asyncio
+
+    from collector import Collector
+
+    collector = Collector(source, building, port, queue_name="logs")
+    try:
+        ready()
+        asyncio.run(collector.run())
+    finally:
+        collector.close()
+
+
+def run_section(section: str, ip: str, port: int, building: str):
+    from data.history import save_history
+    from sections import AppSections
+
+    app_section = AppSections(
+        ip, port, building, queue_name="logs", section=section
+    )
+    (
+        app_section.queue_route,
+        app_section.queue_namespace_provider,
+        callback,
+    ) = sections[section]
+    try:
+        ready()
+        app_section.socket_connection(getattr(app_section, callback))
+    finally:
+        # Flush the broker's outbox
+        app_section.message_broker.close()
+        if app_section.live_slots:
+            app_section.live_slots.close()
+        save_history(app_section.history, config["history"]["snapshot_path"])
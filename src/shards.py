@@ -0,0 +1,219 @@
+import asyncio, hashlib, multiprocessing, os, signal, sys, time
+
+from pymongo.errors import PyMongoError
+
+from collector import Collector, load_gateways
+from config import config
+from data.controllers import Controllers
+from data import mq
+from data.models import GatewayConfig
+from logger import get_logger, setup_logging
+from supervisor import Supervisor
+import metrics
+
+
+log = get_logger(__name__)
+
+
+def shard_of(ip: str, shards: int) -> int:
+    """Shard of a gateway by rendezvous hashing of its IP address.
+
+    A gateway keeps its shard while gateways are added or removed, and only
+    about `1 / shards` of them move when the shard count changes.
+    """
+    return max(
+        range(shards),
+        key=lambda shard: hashlib.blake2b(
+            f"{shard}:{ip}".encode(), digest_size=8
+        ).digest(),
+    )
+
+
+def run_shard(
+    index: int, gateways: list[GatewayConfig], queue_name: str, heartbeat
+):
+    """Worker process of a shard: collects its gateways with a `Collector`
+    of its own broker connection and MongoDB pool."""
+    # Terminated by the coordinator, close the broker on the way out.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    setup_logging()
+    if config["metrics"]["port"]:
+        metrics.serve(port=config["metrics"]["port"] + 1 + index)
+
+    async def beat():
+        while True:
+            heartbeat.value = time.monotonic()
+            await asyncio.sleep(1)
+
+    async def collect(collector: Collector):
+        beating = asyncio.create_task(beat())
+        try:
+            await collector.run()
+        finally:
+            beating.cancel()
+
+    # Every shard spools and snapshots the history of its own gateways, a
+    # spool directory is only used by one process.
+    spool = config["mq"]["spool"]["directory"]
+    snapshot_path = config["history"]["snapshot_path"]
+    collector = Collector(
+        None,
+        None,
+        None,
+        queue_name,
+        message_broker=mq.RabbitMQ(
+            spool_directory=f"{spool}.{index}" if spool else ""
+        ),
+        gateways=gateways,
+        snapshot_path=f"{snapshot_path}.{index}" if snapshot_path else "",
+    )
+    try:
+        asyncio.run(collect(collector))
+    finally:
+        collector.close()
+
+
+class Shard:
+    def __init__(self, index: int, context):
+        self.index = index
+        self.gateways: list[GatewayConfig] = []
+        self.process = None
+        # Last beat of the worker's event loop, `time.monotonic()` is
+        # system-wide on Linux.
+        self.heartbeat = context.Value("d", 0.0)
+        self.supervisor = Supervisor(f"Shard {index}")
+        self.started_at: float = 0.0
+        self.restart_at: float = 0.0
+
+
+class Coordinator:
+    """Sharded Collector
+
+    Spreads gateways over `workers` processes (`shard_of` their IP), so
+    envelope building and serialization use every core of the host:
+
+    + Crashed or stalled shards (no heartbeat for `heartbeat_timeout`
+    seconds) are restarted with `Supervisor` backoff.
+    + Gateways are reloaded from `source` every `refresh_interval` seconds,
+    and only shards whose gateways changed are restarted. A failed reload
+    keeps the current assignment.
+
+    Args:
+        source (str): `db` or gateways JSON file, see `load_gateways`.
+        workers (int): Count of shards, `0` for one per CPU core.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        building: str,
+        port: int | None,
+        queue_name: str,
+        workers: int = config["shards"]["workers"],
+    ):
+        self.source = source
+        self.port = port
+        self.queue_name = queue_name
+        self.controllers = Controllers(building, None)
+        self.context = multiprocessing.get_context("spawn")
+        self.shards: list[Shard] = [
+            Shard(index, self.context)
+            for index in range(workers or os.cpu_count())
+        ]
+
+    def run(self):
+        log.info("Running %s shards.", len(self.shards), code="SHARDS")
+        refresh_at = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= refresh_at:
+                    self.refresh()
+                    refresh_at = now + config["shards"]["refresh_interval"]
+
+                for shard in self.shards:
+                    self.check(shard, time.monotonic())
+                time.sleep(config["shards"]["health_interval"])
+        finally:
+            for shard in self.shards:
+                self.stop(shard)
+
+    def refresh(self):
+        """Reloads the gateways and rebalances them. A failed load, e.g.
+        MongoDB outage or a half-written JSON file, keeps the current
+        assignment until the next refresh."""
+        try:
+            gateways = load_gateways(self.source, self.controllers, self.port)
+        except (PyMongoError, OSError, ValueError, KeyError, TypeError) as e:
+            log.error(
+                "Gateways refresh failed, keeping the current assignment. %s",
+                e,
+                code="SHARDS",
+            )
+            return
+
+        self.rebalance(gateways)
+
+    def rebalance(self, gateways: list[GatewayConfig]):
+        """Assigns gateways to shards and restarts the changed shards."""
+        assignment: list[list[GatewayConfig]] = [[] for _ in self.shards]
+        for gateway in gateways:
+            assignment[shard_of(gateway.ip, len(self.shards))].append(gateway)
+
+        for shard, shard_gateways in zip(self.shards, assignment):
+            if shard_gateways == shard.gateways:
+                continue
+
+            log.info(
+                "Shard %s is assigned %s gateways.",
+                shard.index,
+                len(shard_gateways),
+                code="SHARDS",
+            )
+            self.stop(shard)
+            shard.gateways = shard_gateways
+            shard.restart_at = 0.0
+
+    def check(self, shard: Shard, now: float):
+        if shard.process is None:
+            if shard.gateways and now >= shard.restart_at:
+                self.start(shard, now)
+        elif not shard.process.is_alive():
+            delay = shard.supervisor.failed(now)
+            log.error(
+                "Shard %s exited with %s, restarting in %.1fs.",
+                shard.index,
+                shard.process.exitcode,
+                delay,
+                code="SHARDS",
+            )
+            shard.process = None
+            shard.restart_at = now + delay
+        elif now - shard.heartbeat.value > config["shards"]["heartbeat_timeout"]:
+            log.error("Shard %s is not responding.", shard.index, code="SHARDS")
+            shard.process.kill()
+        elif shard.heartbeat.value > shard.started_at:
+            # Worker is up once its event loop beats
+            shard.supervisor.connected(now)
+
+    def start(self, shard: Shard, now: float):
+        # Grace period for the worker to start beating
+        shard.started_at = shard.heartbeat.value = now
+        shard.process = self.context.Process(
+            target=run_shard,
+            args=(shard.index, shard.gateways, self.queue_name, shard.heartbeat),
+            name=f"shard-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+
+    def stop(self, shard: Shard, timeout: float = 10):
+        if shard.process is None:
+            return
+
+        shard.process.terminate()
+        shard.process.join(timeout)
+        if shard.process.is_alive():
+            shard.process.kill()
+            shard.process.join()
+        shard.process = None
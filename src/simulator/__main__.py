@@ -0,0 +1,44 @@
+"""Parking Gateway Simulator
+
+Runs simulated gateways on loopback addresses `127.0.x.y` for local tests
+and benchmarks without hardware:
+
+```sh
+cd src && python -m simulator -g 10 -s 120 -p 15000
+```
+"""
+
+import argparse, asyncio
+
+from simulator.gateway import serve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="MCI Parking Gateway Simulator")
+    parser.add_argument("-g", "--gateways", type=int, default=1)
+    parser.add_argument("-s", "--sensors", type=int, default=120)
+    parser.add_argument("-p", "--port", type=int, default=15000)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--jitter", type=float, default=0.001)
+    parser.add_argument("--churn", type=float, default=0.02)
+    parser.add_argument("--disconnect-rate", type=float, default=0.005)
+    parser.add_argument("--silence-rate", type=float, default=0.0)
+    parser.add_argument("--lifetime", type=float, default=0.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(
+            serve(
+                args.gateways,
+                args.sensors,
+                args.port,
+                latency=args.latency,
+                jitter=args.jitter,
+                churn=args.churn,
+                disconnect_rate=args.disconnect_rate,
+                silence_rate=args.silence_rate,
+                lifetime=args.lifetime,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
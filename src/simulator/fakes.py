@@ -0,0 +1,329 @@
+import heapq, json, threading, time
+
+import pika
+from pymongo.errors import OperationFailure
+
+from data.envelope import LaravelEnvelope
+from data.mq import RabbitMQ
+from simulator.gateway import gateway_address
+
+
+class FakeBroker:
+    """In-process Stand-in of `RabbitMQ`
+
+    Builds the same Laravel envelopes and counts published messages and
+    bytes per routing key instead of talking to a broker. Consumed messages
+    are delivered by `deliver`.
+    """
+
+    def __init__(self):
+        self.envelopes: dict[str, LaravelEnvelope] = {}
+        self.published: dict[str, int] = {}
+        self.published_bytes: int = 0
+        self.spooled: int = 0
+        self.consumers: dict[str, callable] = {}
+
+    def laravel_based_messaging(self, namespace: str, data: dict) -> bytes:
+        envelope = self.envelopes.get(namespace)
+        if envelope is None:
+            envelope = self.envelopes[namespace] = LaravelEnvelope(namespace)
+        return envelope.build(data)
+
+    @staticmethod
+    def encode(message: dict | bytes) -> bytes:
+        if isinstance(message, bytes):
+            return message
+        return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+    def produce(
+        self,
+        queue_name: str,
+        routing_key: str,
+        message: dict | bytes,
+        traced_at: float | None = None,
+    ):
+        self.published[routing_key] = self.published.get(routing_key, 0) + 1
+        self.published_bytes += len(self.encode(message))
+
+    def spool_message(
+        self, queue_name: str, routing_key: str, message: dict | bytes
+    ):
+        self.spooled += 1
+
+    def consume(
+        self,
+        queue_name: str,
+        routing_key: str,
+        callback,
+        prefetch: int = 1,
+        on_cancel=None,
+    ):
+        self.consumers[routing_key] = callback
+
+    def deliver(self, routing_key: str, body: bytes):
+        """Delivers a message to the consumer of `routing_key`."""
+        self.consumers[routing_key](body, lambda: None)
+
+    def close(self):
+        pass
+
+
+class LoopbackBroker(RabbitMQ):
+    """`RabbitMQ` on an In-process Channel
+
+    Runs the real outbox, batching and publisher confirms against
+    `FakeConnection`, whose channel confirms every message after
+    `confirm_latency` seconds, so the outbox and broker stages of published
+    readings are measured end to end. Published messages and bytes are
+    counted per routing key.
+    """
+
+    def __init__(self, confirm_latency: float = 0.0):
+        self.confirm_latency = confirm_latency
+        self.published: dict[str, int] = {}
+        self.published_bytes: int = 0
+        super().__init__(spool_directory="")
+
+    def run_io_loop(self):
+        while not self.closing:
+            self.connection = FakeConnection(self, self.on_connection_closed)
+            self.on_connection_open(self.connection)
+            self.connection.ioloop.start()
+
+
+class FakeIOLoop:
+    """Callbacks and timers of `FakeConnection`, run by `start` in the
+    connection's I/O thread."""
+
+    def __init__(self):
+        self.callbacks: list[tuple[float, int, callable]] = []
+        self.scheduled: int = 0
+        self.stopped: bool = False
+        self._condition = threading.Condition()
+
+    def call_later(self, delay: float, callback):
+        with self._condition:
+            self.scheduled += 1
+            heapq.heappush(
+                self.callbacks, (time.monotonic() + delay, self.scheduled, callback)
+            )
+            self._condition.notify()
+
+    def add_callback_threadsafe(self, callback):
+        self.call_later(0, callback)
+
+    def start(self):
+        while not self.stopped:
+            with self._condition:
+                now = time.monotonic()
+                if not self.callbacks or self.callbacks[0][0] > now:
+                    self._condition.wait(
+                        self.callbacks[0][0] - now if self.callbacks else None
+                    )
+                    continue
+                _, _, callback = heapq.heappop(self.callbacks)
+            callback()
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+
+
+class FakeConnection:
+    """In-process Stand-in of `pika.SelectConnection` and its channel
+
+    Declarations succeed at once, and every published message is confirmed
+    after the broker's `confirm_latency`.
+    """
+
+    def __init__(self, broker: LoopbackBroker, on_close_callback):
+        self.broker = broker
+        self.on_close_callback = on_close_callback
+        self.ioloop = FakeIOLoop()
+        self.is_open: bool = True
+        self.delivery_tag: int = 0
+        self.on_confirm = None
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.on_close_callback(self, None)
+
+    def channel(self, on_open_callback):
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def confirm_delivery(self, ack_nack_callback, callback):
+        self.on_confirm = ack_nack_callback
+        callback(None)
+
+    def exchange_declare(self, callback, **kwargs):
+        callback(None)
+
+    def queue_declare(self, queue: str, callback, **kwargs):
+        callback(None)
+
+    def queue_bind(self, callback, **kwargs):
+        callback(None)
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, **kwargs):
+        broker = self.broker
+        broker.published[routing_key] = broker.published.get(routing_key, 0) + 1
+        broker.published_bytes += len(body)
+        self.delivery_tag += 1
+        frame = FakeFrame(pika.spec.Basic.Ack(delivery_tag=self.delivery_tag))
+        self.ioloop.call_later(broker.confirm_latency, lambda: self.confirm(frame))
+
+    def confirm(self, frame: "FakeFrame"):
+        if self.is_open:
+            self.on_confirm(frame)
+
+
+class FakeFrame:
+    def __init__(self, method):
+        self.method = method
+
+
+class FakeCollection:
+    def __init__(self, documents: list[dict]):
+        self.documents = documents
+
+    def matches(self, query: dict) -> list[dict]:
+        return [
+            document
+            for document in self.documents
+            if all(document.get(key) == value for key, value in query.items())
+        ]
+
+    @staticmethod
+    def project(document: dict, projection: dict | None) -> dict:
+        if not projection:
+            return dict(document)
+        return {
+            key: value
+            for key, value in document.items()
+            if projection.get(key)
+        }
+
+    def find_one(self, query: dict, projection: dict | None = None):
+        documents = self.matches(query)
+        return self.project(documents[0], projection) if documents else None
+
+    def find(
+        self,
+        query: dict,
+        projection: dict | None = None,
+        sort: list[tuple[str, int]] | None = None,
+    ) -> list[dict]:
+        documents = self.matches(query)
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return [self.project(document, projection) for document in documents]
+
+    def count_documents(self, query: dict) -> int:
+        return len(self.matches(query))
+
+
+class FakeDatabase:
+    """In-process Stand-in of the MongoDB Database
+
+    Only `GateWay`, `Slot` and `RFID` collections with the queries of
+    `Controllers` and `TagIndex`. Change streams are not supported, like a
+    standalone server.
+    """
+
+    def __init__(
+        self, gateways: list[dict], slots: list[dict], tags: list[dict] = ()
+    ):
+        self.GateWay = FakeCollection(gateways)
+        self.Slot = FakeCollection(slots)
+        self.RFID = FakeCollection(list(tags))
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return getattr(self, name)
+
+    @classmethod
+    def simulated(
+        cls, building: str, gateways: int, sensors: int, port: int
+    ) -> "FakeDatabase":
+        """Database of `simulator.gateway.serve` gateways, one floor each."""
+        gateway_documents: list[dict] = []
+        slot_documents: list[dict] = []
+        for index in range(gateways):
+            ip, gateway_port = gateway_address(index, port)
+            gateway_documents.append(
+                {
+                    "building": building,
+                    "Status": 1,
+                    "ip": ip,
+                    "port": gateway_port,
+                    "floor": index + 1,
+                }
+            )
+            slot_documents.extend(
+                {"building": building, "floor": index + 1, "id": f"{sensor:02X}"}
+                for sensor in range(1, sensors + 1)
+            )
+        return cls(gateway_documents, slot_documents)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("Change streams are not supported.")
+
+
+class FakeRedis:
+    """In-process Stand-in of the Redis Client
+
+    Only hashes and transactional pipelines of `LiveSlotCache`, counting
+    round trips (`executed` pipelines).
+    """
+
+    def __init__(self):
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.executed: int = 0
+
+    def hset(
+        self,
+        name: str,
+        key: str | None = None,
+        value=None,
+        mapping: dict | None = None,
+    ) -> int:
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        hash = self.hashes.setdefault(name, {})
+        added = len(fields.keys() - hash.keys())
+        hash.update({str(k): str(v) for k, v in fields.items()})
+        return added
+
+    def hget(self, name: str, key: str) -> str | None:
+        return self.hashes.get(name, {}).get(key)
+
+    def hgetall(self, name: str) -> dict[str, str]:
+        return dict(self.hashes.get(name, {}))
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.commands: list[tuple] = []
+
+    def hset(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+        return self
+
+    def execute(self) -> list:
+        self.client.executed += 1
+        results = [self.client.hset(*args, **kwargs) for args, kwargs in self.commands]
+        self.commands = []
+        return results
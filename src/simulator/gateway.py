@@ -0,0 +1,137 @@
+import asyncio, random
+
+from config import config
+from data.models import SensorState
+
+
+def gateway_address(index: int, port: int) -> tuple[str, int]:
+    """Address of the `index`th simulated gateway.
+
+    Every gateway has its own loopback IP (Linux routes whole `127.0.0.0/8`
+    to loopback), as gateways are identified by IP address.
+    """
+    return f"127.0.{1 + index // 250}.{1 + index % 250}", port
+
+
+class SimulatedGateway:
+    """Parking Gateway Simulator
+
+    Answers the sensor read protocol (`<sensor_id>03000A0005`) of its
+    `sensors` like a real gateway bus, one request at a time:
+
+    Args:
+        sensors (list[str]): Hex sensor ids of the floor.
+        latency (float): Bus time of one request in seconds.
+        jitter (float): Random extra latency up to this many seconds.
+        churn (float): Probability of a slot flipping free/occupied per read.
+        disconnect_rate (float): Probability of a disconnected (`00`) answer.
+        silence_rate (float): Probability of not answering at all.
+        lifetime (float): Mean seconds before the gateway drops a client
+        connection, `0` to never drop it.
+    """
+
+    def __init__(
+        self,
+        sensors: list[str],
+        latency: float = 0.005,
+        jitter: float = 0.001,
+        churn: float = 0.02,
+        disconnect_rate: float = 0.005,
+        silence_rate: float = 0.0,
+        lifetime: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.sensors = sensors
+        self.latency = latency
+        self.jitter = jitter
+        self.churn = churn
+        self.disconnect_rate = disconnect_rate
+        self.silence_rate = silence_rate
+        self.lifetime = lifetime
+        self.random = random.Random(seed)
+        self.command: bytes = config["client_commands"]["sensor_read"].encode()
+        self.frame_length: int = config["client_commands"][
+            "sensor_response_length"
+        ]
+        self.states: dict[str, SensorState] = {
+            sensor_id: self.random.choice((SensorState.free, SensorState.occupied))
+            for sensor_id in sensors
+        }
+        self.requests: int = 0
+
+    def response(self, sensor_id: str) -> bytes | None:
+        chance = self.random.random()
+        if chance < self.silence_rate or sensor_id not in self.states:
+            return None
+
+        frame = bytearray(self.frame_length)
+        if chance < self.silence_rate + self.disconnect_rate:
+            return bytes(frame)
+
+        if self.random.random() < self.churn:
+            self.states[sensor_id] = (
+                SensorState.free
+                if self.states[sensor_id] == SensorState.occupied
+                else SensorState.occupied
+            )
+
+        frame[0] = int(sensor_id, 16) & 0xFF
+        frame[1] = 0x03
+        frame[2] = self.frame_length - 5
+        frame[6] = self.states[sensor_id]
+        return bytes(frame)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        loop = asyncio.get_running_loop()
+        closes_at = (
+            loop.time() + self.random.expovariate(1 / self.lifetime)
+            if self.lifetime
+            else None
+        )
+        buffer = b""
+
+        try:
+            while data := await reader.read(4096):
+                buffer += data
+                while (index := buffer.find(self.command)) != -1:
+                    sensor_id = buffer[:index].decode(errors="replace")
+                    buffer = buffer[index + len(self.command) :]
+                    self.requests += 1
+
+                    await asyncio.sleep(
+                        self.latency + self.random.random() * self.jitter
+                    )
+                    frame = self.response(sensor_id)
+                    if frame:
+                        writer.write(frame)
+
+                await writer.drain()
+                if closes_at and loop.time() >= closes_at:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(gateways: int, sensors: int, port: int, **options):
+    """Runs `gateways` simulated gateways with `sensors` sensors each."""
+    if not 0 < sensors < 256:
+        raise ValueError("Sensor address is one byte, use 1 to 255 sensors.")
+
+    servers = []
+    for index in range(gateways):
+        gateway = SimulatedGateway(
+            [f"{sensor:02X}" for sensor in range(1, sensors + 1)],
+            seed=index,
+            **options,
+        )
+        ip, gateway_port = gateway_address(index, port)
+        servers.append(
+            await asyncio.start_server(gateway.handle, ip, gateway_port)
+        )
+
+    print(f"[SIMULATOR]: {gateways} gateways with {sensors} sensors on :{port}")
+    await asyncio.gather(*(server.serve_forever() for server in servers))
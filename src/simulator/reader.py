@@ -0,0 +1,69 @@
+import asyncio, itertools, random, time
+
+from config import config
+
+
+class SimulatedReader:
+    """RFID Reader Simulator
+
+    Streams a line per tag read, like a reader in notification mode: cars
+    arrive every `1 / rate` seconds on average, and the car's tag is read
+    `repeats` times, `repeat_spacing` seconds apart, while it's in the field.
+
+    Args:
+        tags (list[str]): Tags of the arriving cars, in turn.
+        sent (callable): Called with `(tag, time.monotonic())` at the first
+        read of every car.
+    """
+
+    def __init__(
+        self,
+        tags: list[str],
+        rate: float = 5.0,
+        repeats: int = 5,
+        repeat_spacing: float = 0.05,
+        sent=None,
+        seed: int | None = None,
+    ):
+        self.tags = tags
+        self.rate = rate
+        self.repeats = repeats
+        self.repeat_spacing = repeat_spacing
+        self.sent = sent
+        self.random = random.Random(seed)
+        self.delimiter: bytes = config["client_commands"]["rfid"][
+            "delimiter"
+        ].encode()
+
+    async def car(self, writer: asyncio.StreamWriter, tag: str):
+        line = tag.encode() + self.delimiter
+        for read in range(self.repeats):
+            if read:
+                await asyncio.sleep(self.repeat_spacing)
+            writer.write(line)
+            await writer.drain()
+            if not read and self.sent:
+                self.sent(tag, time.monotonic())
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        cars: set[asyncio.Task] = set()
+        try:
+            for tag in itertools.cycle(self.tags):
+                await asyncio.sleep(self.random.expovariate(self.rate))
+                task = asyncio.create_task(self.car(writer, tag))
+                cars.add(task)
+                task.add_done_callback(cars.discard)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_reader(host: str, port: int, tags: list[str], **options):
+    """Runs a simulated RFID reader on `host:port`."""
+    reader = SimulatedReader(tags, **options)
+    server = await asyncio.start_server(reader.handle, host, port)
+    print(f"[SIMULATOR]: RFID reader with {len(tags)} tags on {host}:{port}")
+    await server.serve_forever()
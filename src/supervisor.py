@@ -0,0 +1,99 @@
+import random, time
+
+from config import config
+from data.models import ConnectionStats
+from logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class Supervisor:
+    """Reconnect Supervisor of a Connection
+
+    Paces reconnect attempts of one gateway socket or the broker connection
+    with jittered exponential backoff: the `n`th consecutive failure waits a
+    random delay between `0` and `min(backoff_max, backoff_base * 2 ** (n - 1))`,
+    so many connections lost together don't reconnect together.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    connection is only tried again every `open_timeout` seconds (half-open),
+    until an attempt succeeds and the circuit closes.
+
+    A connection only counts as up once it's healthy, e.g. a gateway that
+    answered a floor scan, so a gateway accepting connections and dropping
+    them right away keeps backing off. Keeps reconnect time and downtime of
+    the connection in `stats`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backoff_base: float = config["supervisor"]["backoff_base"],
+        backoff_max: float = config["supervisor"]["backoff_max"],
+        failure_threshold: int = config["supervisor"]["failure_threshold"],
+        open_timeout: float = config["supervisor"]["open_timeout"],
+    ):
+        self.name = name
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_timeout = open_timeout
+        self.random = random.Random()
+
+        # Consecutive failures since the connection was last up
+        self.attempts: int = 0
+        self.up: bool = False
+        self.stats = ConnectionStats()
+
+    def is_open(self) -> bool:
+        return self.attempts >= self.failure_threshold
+
+    def connected(self, now: float | None = None):
+        """Closes the circuit and records the outage, if any."""
+        if self.up:
+            return
+
+        now = time.monotonic() if now is None else now
+        self.up = True
+        self.stats.connects += 1
+        if self.stats.down_since is not None:
+            self.stats.reconnect_time = now - self.stats.down_since
+            self.stats.downtime += self.stats.reconnect_time
+            self.stats.down_since = None
+            log.info(
+                "%s reconnected after %.1fs",
+                self.name,
+                self.stats.reconnect_time,
+                code="SUPERVISOR",
+                fields={
+                    "attempts": self.attempts,
+                    "downtime": round(self.stats.downtime, 1),
+                },
+            )
+        self.attempts = 0
+
+    def failed(self, now: float | None = None) -> float:
+        """Records a failed or lost connection and returns seconds to wait
+        before the next attempt."""
+        now = time.monotonic() if now is None else now
+        self.up = False
+        self.stats.failures += 1
+        if self.stats.down_since is None:
+            self.stats.down_since = now
+        self.attempts += 1
+
+        if self.is_open():
+            if self.attempts == self.failure_threshold:
+                log.warning(
+                    "%s circuit is open after %s failures, retry every %.0fs.",
+                    self.name,
+                    self.attempts,
+                    self.open_timeout,
+                    code="SUPERVISOR",
+                )
+            return self.open_timeout
+
+        return self.random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** (self.attempts - 1))
+        )
@@ -0,0 +1,153 @@
+"""Precompiled `LaravelEnvelope` against the original per-message builder.
+
+```sh
+cd src && python -m unittest discover -s ../tests
+```
+"""
+
+import json, unittest
+
+from bench.envelope import JOB_ID, JOB_UUID, NAMESPACE, legacy_messaging
+from data.envelope import LaravelEnvelope
+
+
+PAYLOADS = {
+    "sensor": {
+        "ip_address": "192.168.1.10",
+        "sensor_id": "0A",
+        "status": True,
+        "message": [{"level": "info", "content": 1301}],
+    },
+    "occupancy": {
+        "building": "vanak",
+        "floors": {
+            "1": {"free": 12, "occupied": 30, "disconnected": 0, "unknown": 1},
+            "2": {"free": 0, "occupied": 42, "disconnected": 2, "unknown": 0},
+        },
+        "ratio": 0.714,
+    },
+    "rfid": {
+        "tag": "E2000017221101441890AB12",
+        "registered": False,
+        "card": None,
+        "message": [{"level": "warning", "content": 3302}],
+    },
+    "trace": {
+        "sensor_id": "FF",
+        "trace": {"sent_at": 1729252800.125, "monotonic": [0.5, 0.507, 0.508]},
+    },
+    "escaped": {
+        "message": 'quote " backslash \\ slash / newline \n tab \t',
+        "owner": "پارکینگ همراه اول",
+        "emoji": "🚗",
+    },
+    "empty": {},
+}
+
+
+def php_unserialize(serialized: str):
+    """Minimal PHP `unserialize`: null, bool, int, float, string, array and
+    object (as `(class_name, properties)`)."""
+    raw: bytes = serialized.encode("utf-8")
+
+    def parse(position: int):
+        kind = raw[position : position + 1]
+        if kind == b"N":
+            return None, position + 2
+
+        if kind in (b"b", b"i", b"d"):
+            end = raw.index(b";", position)
+            value = raw[position + 2 : end].decode()
+            match kind:
+                case b"b":
+                    return value == "1", end + 1
+                case b"i":
+                    return int(value), end + 1
+                case _:
+                    return float(value), end + 1
+
+        if kind == b"s":
+            colon = raw.index(b":", position + 2)
+            length = int(raw[position + 2 : colon])
+            start = colon + 2
+            value = raw[start : start + length].decode("utf-8")
+            if raw[start + length : start + length + 2] != b'";':
+                raise ValueError(f"String length mismatch at {position}")
+            return value, start + length + 2
+
+        class_name = None
+        if kind == b"O":
+            colon = raw.index(b":", position + 2)
+            length = int(raw[position + 2 : colon])
+            class_name = raw[colon + 2 : colon + 2 + length].decode("utf-8")
+            # Points to the closing quote, like `a` of arrays
+            position = colon + 2 + length
+        elif kind != b"a":
+            raise ValueError(f"Unknown PHP type at {position}: {kind}")
+
+        colon = raw.index(b":", position + 2)
+        count = int(raw[position + 2 : colon])
+        position = colon + 2
+        items: dict = {}
+        for _ in range(count):
+            key, position = parse(position)
+            items[key], position = parse(position)
+        if raw[position : position + 1] != b"}":
+            raise ValueError(f"Unterminated PHP array at {position}")
+
+        value = (class_name, items) if class_name else items
+        return value, position + 1
+
+    value, end = parse(0)
+    if end != len(raw):
+        raise ValueError("Trailing data after PHP value")
+    return value
+
+
+def php_value(value):
+    """Expected PHP value of a Python value, arrays as dicts."""
+    if isinstance(value, (list, tuple)):
+        return {index: php_value(item) for index, item in enumerate(value)}
+    if isinstance(value, dict):
+        return {key: php_value(item) for key, item in value.items()}
+    return value
+
+
+class LaravelEnvelopeTest(unittest.TestCase):
+    def setUp(self):
+        self.envelope = LaravelEnvelope(NAMESPACE)
+
+    def test_matches_legacy_bytes(self):
+        for name, data in PAYLOADS.items():
+            with self.subTest(name):
+                self.assertEqual(
+                    self.envelope.render(data, JOB_UUID, JOB_ID),
+                    legacy_messaging(NAMESPACE, data, JOB_UUID, JOB_ID),
+                )
+
+    def test_command_unserializes(self):
+        for name, data in PAYLOADS.items():
+            with self.subTest(name):
+                body = self.envelope.render(data, JOB_UUID, JOB_ID)
+                job = json.loads(body)
+                class_name, properties = php_unserialize(job["data"]["command"])
+                self.assertEqual(class_name, NAMESPACE)
+                self.assertEqual(
+                    properties,
+                    {
+                        f"\u0000{NAMESPACE}\u0000data": php_value(data),
+                        "connection": "rabbitmq",
+                        "queue": "logs",
+                    },
+                )
+                self.assertEqual((job["uuid"], job["id"]), (JOB_UUID, JOB_ID))
+
+    def test_build_uses_new_ids(self):
+        first = json.loads(self.envelope.build(PAYLOADS["sensor"]))
+        second = json.loads(self.envelope.build(PAYLOADS["sensor"]))
+        self.assertNotEqual(first["uuid"], second["uuid"])
+        self.assertNotEqual(first["id"], first["uuid"])
+
+
+if __name__ == "__main__":
+    unittest.main()